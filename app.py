@@ -1,9 +1,10 @@
 import streamlit as st
 import os
 import time
+import tempfile
 import urllib.parse
 import json
-from main import generate_diagram, reset_session
+from main import generate_diagram, reset_session, undo_session, redo_session, branch_session, delete_session_files
 
 st.set_page_config(page_title="Diagram Bot Pro", layout="wide")
 
@@ -16,6 +17,128 @@ if 'diagram_type' not in st.session_state:
     st.session_state.diagram_type = None
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
+if 'redo_history' not in st.session_state:
+    st.session_state.redo_history = []
+if 'restored' not in st.session_state:
+    st.session_state.restored = None
+
+# ============================================================================
+#                           RESULTS DISPLAY
+# ============================================================================
+
+def show_result(result, message, key):
+    """Diagram, edit links and downloads for a generate_diagram-style result"""
+    # File paths (the pipeline only returns artifacts once they are complete)
+    unique_name = result["unique_name"]
+    artifacts = result["artifacts"]
+    png_path = artifacts.get(".png")
+    xml_path = artifacts.get(".xml")
+    svg_path = artifacts.get(".svg")
+    
+    if png_path:
+        st.success(message)
+        
+        col_res1, col_res2 = st.columns([2, 1])
+        
+        with col_res1:
+            st.subheader(" Visual Diagram")
+            st.image(png_path, use_container_width=True)
+        
+        with col_res2:
+            st.subheader(" Downloads & Edit")
+            
+            # Edit button based on type
+            if result["diagram_type"] == "d2":
+                # D2 diagrams: Terrastruct link
+                if result["terrastruct_link"]:
+                    st.markdown(f"""
+                        <a href="{result['terrastruct_link']}" target="_blank">
+                            <button style="
+                                width: 100%;
+                                background-color: #4CAF50;
+                                color: white;
+                                padding: 12px;
+                                border: none;
+                                border-radius: 8px;
+                                cursor: pointer;
+                                font-size: 16px;
+                                font-weight: bold;
+                                margin-bottom: 10px;">
+                                🎨 Edit in Terrastruct
+                            </button>
+                        </a>
+                    """, unsafe_allow_html=True)
+                    st.caption("D2 diagrams open in Terrastruct Play")
+                
+                # SVG download for D2
+                if svg_path:
+                    with open(svg_path, "rb") as f:
+                        st.download_button(
+                            label=" Download SVG",
+                            data=f,
+                            file_name=f"{unique_name}.svg",
+                            mime="image/svg+xml",
+                            key=f"{key}_{unique_name}_d2_svg"
+                        )
+            
+            else:
+                # Cloud/Mermaid: Draw.io link
+                if xml_path:
+                    with open(xml_path, "r", encoding="utf-8") as f:
+                        xml_data = f.read()
+                    
+                    encoded_xml = urllib.parse.quote(xml_data)
+                    drawio_url = f"https://app.diagrams.net/#R{encoded_xml}"
+                    
+                    st.markdown(f"""
+                        <a href="{drawio_url}" target="_blank">
+                            <button style="
+                                width: 100%;
+                                background-color: #ff4b4b;
+                                color: white;
+                                padding: 12px;
+                                border: none;
+                                border-radius: 8px;
+                                cursor: pointer;
+                                font-size: 16px;
+                                font-weight: bold;
+                                margin-bottom: 10px;">
+                                ✏️ Edit in Draw.io
+                            </button>
+                        </a>
+                    """, unsafe_allow_html=True)
+            
+            st.markdown("---")
+            
+            # Dynamic download buttons
+            extensions = {
+                ".png": ("Download PNG", "image/png"),
+                ".xml": ("Download XML", "application/xml"),
+                ".dot": ("Download DOT", "text/plain"),
+                ".mmd": ("Download Mermaid", "text/plain"),
+                ".d2": ("Download D2", "text/plain"),
+                ".svg": ("Download SVG", "image/svg+xml")
+            }
+            
+            for ext, (label, mime) in extensions.items():
+                file_path = artifacts.get(ext)
+                if file_path:
+                    with open(file_path, "rb") as f:
+                        st.download_button(
+                            label=label,
+                            data=f,
+                            file_name=f"{unique_name}{ext}",
+                            mime=mime,
+                            key=f"{key}_{unique_name}_{ext}"
+                        )
+            
+            st.markdown("---")
+            
+            # Iteration tip
+            st.info("💡 **Tip:** Describe another change to keep editing this diagram!")
+    
+    else:
+        st.error(" PNG not found. Check logs for errors.")
 
 # ============================================================================
 #                           HEADER
@@ -26,7 +149,7 @@ st.markdown("Generate & Iteratively Edit Professional Diagrams using AI")
 
 # Iteration counter in header
 if st.session_state.iteration_count > 0:
-    st.info(f" **Active Session** | Iteration: {st.session_state.iteration_count}/10 | Type: {st.session_state.diagram_type or 'N/A'}")
+    st.info(f" **Active Session** | Iteration: {st.session_state.iteration_count} | Type: {st.session_state.diagram_type or 'N/A'}")
 
 # ============================================================================
 #                           SIDEBAR
@@ -46,6 +169,8 @@ with st.sidebar:
             st.session_state.iteration_count = 0
             st.session_state.diagram_type = None
             st.session_state.chat_history = []
+            st.session_state.redo_history = []
+            st.session_state.restored = None
             st.rerun()
     else:
         st.info("No active session")
@@ -54,14 +179,47 @@ with st.sidebar:
     
     # Chat history
     st.header(" Conversation History")
+    history_action = None
     if st.session_state.chat_history:
+        # Undo/redo/branch restore stored snapshots: no LLM call, no re-render
+        col_undo, col_redo = st.columns(2)
+        if col_undo.button("↶ Undo", disabled=st.session_state.iteration_count <= 1, use_container_width=True):
+            history_action = "undo"
+        if col_redo.button("↷ Redo", disabled=not st.session_state.redo_history, use_container_width=True):
+            history_action = "redo"
+        
         for i, entry in enumerate(st.session_state.chat_history, 1):
             with st.expander(f"Step {i}: {entry['action']}", expanded=(i == len(st.session_state.chat_history))):
                 st.caption(entry['prompt'][:100] + "..." if len(entry['prompt']) > 100 else entry['prompt'])
                 st.caption(f"Time: {entry['timestamp']}")
+                if i < len(st.session_state.chat_history) and st.button("Branch from here", key=f"branch_{i}"):
+                    history_action = i
     else:
         st.caption("No history yet")
     
+    if history_action is not None:
+        try:
+            session_id = st.session_state.current_session_id
+            if history_action == "undo":
+                result = undo_session(session_id)
+                st.session_state.redo_history.append(st.session_state.chat_history.pop())
+            elif history_action == "redo":
+                result = redo_session(session_id)
+                st.session_state.chat_history.append(st.session_state.redo_history.pop())
+            else:
+                result = branch_session(session_id, history_action)
+                st.session_state.chat_history = st.session_state.chat_history[:history_action]
+                st.session_state.redo_history = []
+            
+            st.session_state.current_session_id = result["session_id"]
+            st.session_state.iteration_count = result["iteration"]
+            st.session_state.diagram_type = result["diagram_type"]
+            st.session_state.restored = result
+        except Exception as e:
+            st.error(f" Error: {str(e)}")
+        else:
+            st.rerun()
+    
     st.markdown("---")
     
     # Project files
@@ -74,12 +232,17 @@ with st.sidebar:
         else:
             st.caption("No files yet")
     
-    if st.button("🗑️ Clear All Output"):
-        if os.path.exists("output"):
-            for f in os.listdir("output"):
-                os.remove(os.path.join("output", f))
-            st.success("Cleared!")
-            st.rerun()
+    # Only this session's files; everything else is cleaned up by the background janitor
+    if st.session_state.current_session_id and st.button("🗑️ Delete This Session's Files"):
+        delete_session_files(st.session_state.current_session_id)
+        st.session_state.current_session_id = None
+        st.session_state.iteration_count = 0
+        st.session_state.diagram_type = None
+        st.session_state.chat_history = []
+        st.session_state.redo_history = []
+        st.session_state.restored = None
+        st.success("Deleted!")
+        st.rerun()
     
     st.markdown("---")
     
@@ -97,7 +260,7 @@ with st.sidebar:
            - "Remove the S3 bucket"
            - "Add a Lambda function"
            - "Change RDS to DynamoDB"
-        3. Edit up to 10 times per session
+        3. Keep editing: older steps are summarized, so sessions have no step limit
         
         **Example Prompts:**
         - "Draw AWS with EC2, S3, RDS"
@@ -105,6 +268,11 @@ with st.sidebar:
         - "Make an ER diagram for e-commerce"
         """)
 
+# Diagram restored from history (undo/redo/branch)
+restored = st.session_state.restored
+if restored:
+    show_result(restored, f" Restored step {restored['iteration']} from history", key="restored")
+
 # ============================================================================
 #                           MAIN INPUT AREA
 # ============================================================================
@@ -138,11 +306,7 @@ with col_upload:
 # Determine input
 final_input = None
 if uploaded_file is not None:
-    os.makedirs("output", exist_ok=True)
-    temp_file_path = os.path.join("output", uploaded_file.name)
-    with open(temp_file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    final_input = temp_file_path
+    final_input = uploaded_file.name  # written to a temporary file only while it is being drawn
     st.info(f"📎 Using: **{uploaded_file.name}**")
 elif prompt:
     final_input = prompt
@@ -153,7 +317,7 @@ elif prompt:
 
 # Button text based on state
 if st.session_state.iteration_count > 0:
-    button_text = f" Apply Edit (Step {st.session_state.iteration_count + 1}/10)"
+    button_text = f" Apply Edit (Step {st.session_state.iteration_count + 1})"
     button_type = "secondary"
 else:
     button_text = " Generate Diagram"
@@ -161,162 +325,40 @@ else:
 
 if st.button(button_text, type=button_type, use_container_width=True):
     if final_input:
-        # Check iteration limit
-        if st.session_state.iteration_count >= 10:
-            st.error(" Maximum iterations (10) reached. Please start a new session.")
-        else:
-            with st.spinner(" AI is working..."):
-                try:
-                    # Call generation engine
+        with st.spinner(" AI is working..."):
+            try:
+                # Call generation engine; uploads stay out of output/, which only holds session files
+                with tempfile.TemporaryDirectory() as upload_dir:
+                    source = final_input
+                    if uploaded_file is not None:
+                        source = os.path.join(upload_dir, uploaded_file.name)
+                        with open(source, "wb") as f:
+                            f.write(uploaded_file.getbuffer())
                     result = generate_diagram(
-                        final_input,
+                        source,
                         session_id=st.session_state.current_session_id,
                         is_continuation=(st.session_state.iteration_count > 0)
                     )
-                    
-                    # Update session state
-                    st.session_state.current_session_id = result["session_id"]
-                    st.session_state.iteration_count = result["iteration"]
-                    st.session_state.diagram_type = result["diagram_type"]
-                    
-                    # Add to history
-                    st.session_state.chat_history.append({
-                        "action": "Edit" if result["is_edit"] else "Create",
-                        "prompt": final_input if isinstance(final_input, str) else f"File: {uploaded_file.name}",
-                        "timestamp": time.strftime("%H:%M:%S")
-                    })
-                    
-                    # File paths
-                    unique_name = result["unique_name"]
-                    png_path = f"output/{unique_name}.png"
-                    xml_path = f"output/{unique_name}.xml"
-                    svg_path = f"output/{unique_name}.svg"
-                    
-                    time.sleep(5)  # File sync
-                    
-                    abs_xml_path = os.path.abspath(f"output/{unique_name}.xml")
-                    abs_png_path =  os.path.abspath(f"output/{unique_name}.png")
-
-
-                    if os.path.exists(abs_xml_path):
-                        with open(abs_xml_path, "r", encoding="utf-8") as f:
-                            xml_data = f.read()
-                    # ... rest of your Draw.io button code
-                    else:
-                        st.warning("Draw.io file is still being processed. Please wait 2 seconds and click 'Generate' again to refresh.")
-                    # ============================================================================
-                    #                           RESULTS DISPLAY
-                    # ============================================================================
-                    
-                    if os.path.exists(png_path):
-                        st.success(" Generation Complete!")
-                        
-                        col_res1, col_res2 = st.columns([2, 1])
-                        
-                        with col_res1:
-                            st.subheader(" Visual Diagram")
-                            st.image(png_path, use_container_width=True)
-                        
-                        with col_res2:
-                            st.subheader(" Downloads & Edit")
-                            
-                            # Edit button based on type
-                            if result["diagram_type"] == "d2":
-                                # D2 diagrams: Terrastruct link
-                                if result["terrastruct_link"]:
-                                    st.markdown(f"""
-                                        <a href="{result['terrastruct_link']}" target="_blank">
-                                            <button style="
-                                                width: 100%;
-                                                background-color: #4CAF50;
-                                                color: white;
-                                                padding: 12px;
-                                                border: none;
-                                                border-radius: 8px;
-                                                cursor: pointer;
-                                                font-size: 16px;
-                                                font-weight: bold;
-                                                margin-bottom: 10px;">
-                                                🎨 Edit in Terrastruct
-                                            </button>
-                                        </a>
-                                    """, unsafe_allow_html=True)
-                                    st.caption("D2 diagrams open in Terrastruct Play")
-                                
-                                # SVG download for D2
-                                if os.path.exists(svg_path):
-                                    with open(svg_path, "rb") as f:
-                                        st.download_button(
-                                            label=" Download SVG",
-                                            data=f,
-                                            file_name=f"{unique_name}.svg",
-                                            mime="image/svg+xml"
-                                        )
-                            
-                            else:
-                                # Cloud/Mermaid: Draw.io link
-                                if os.path.exists(xml_path):
-                                    with open(xml_path, "r", encoding="utf-8") as f:
-                                        xml_data = f.read()
-                                    
-                                    encoded_xml = urllib.parse.quote(xml_data)
-                                    drawio_url = f"https://app.diagrams.net/#R{encoded_xml}"
-                                    
-                                    st.markdown(f"""
-                                        <a href="{drawio_url}" target="_blank">
-                                            <button style="
-                                                width: 100%;
-                                                background-color: #ff4b4b;
-                                                color: white;
-                                                padding: 12px;
-                                                border: none;
-                                                border-radius: 8px;
-                                                cursor: pointer;
-                                                font-size: 16px;
-                                                font-weight: bold;
-                                                margin-bottom: 10px;">
-                                                ✏️ Edit in Draw.io
-                                            </button>
-                                        </a>
-                                    """, unsafe_allow_html=True)
-                            
-                            st.markdown("---")
-                            
-                            # Dynamic download buttons
-                            extensions = {
-                                ".png": ("Download PNG", "image/png"),
-                                ".xml": ("Download XML", "application/xml"),
-                                ".dot": ("Download DOT", "text/plain"),
-                                ".mmd": ("Download Mermaid", "text/plain"),
-                                ".d2": ("Download D2", "text/plain"),
-                                ".svg": ("Download SVG", "image/svg+xml")
-                            }
-                            
-                            for ext, (label, mime) in extensions.items():
-                                file_path = f"output/{unique_name}{ext}"
-                                if os.path.exists(file_path):
-                                    with open(file_path, "rb") as f:
-                                        st.download_button(
-                                            label=label,
-                                            data=f,
-                                            file_name=f"{unique_name}{ext}",
-                                            mime=mime,
-                                            key=f"btn_{unique_name}_{ext}"
-                                        )
-                            
-                            st.markdown("---")
-                            
-                            # Iteration tip
-                            if st.session_state.iteration_count < 10:
-                                st.info(f"💡 **Tip:** You can make {10 - st.session_state.iteration_count} more edits to this diagram!")
-                    
-                    else:
-                        st.error(" PNG not found. Check logs for errors.")
                 
-                except Exception as e:
-                    st.error(f" Error: {str(e)}")
-                    import traceback
-                    st.code(traceback.format_exc())
+                # Update session state
+                st.session_state.restored = None
+                st.session_state.redo_history = []
+                st.session_state.current_session_id = result["session_id"]
+                st.session_state.iteration_count = result["iteration"]
+                st.session_state.diagram_type = result["diagram_type"]
+                
+                # Add to history
+                st.session_state.chat_history.append({
+                    "action": "Edit" if result["is_edit"] else "Create",
+                    "prompt": f"File: {uploaded_file.name}" if uploaded_file is not None else final_input,
+                    "timestamp": time.strftime("%H:%M:%S")
+                })
+                
+                show_result(result, " Generation Complete!", key="generated")
+            except Exception as e:
+                st.error(f" Error: {str(e)}")
+                import traceback
+                st.code(traceback.format_exc())
     
     else:
         st.warning(" Please enter a prompt or upload a file first.")
@@ -0,0 +1,111 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+# ============================================================================
+#                           VERSIONED ARTIFACT STORE
+# ============================================================================
+# Immutable snapshots of each iteration: the diagram source plus every
+# rendered artifact. Files are stored once per content hash, shared by all
+# sessions, and a version is a small manifest naming them; its id is the hash
+# of that manifest, so identical iterations map to the same version.
+#
+#   <root>/blobs/ab/<sha256><ext>     artifact bytes
+#   <root>/versions/cd/<sha256>.json  {"diagram_type", "code", "artifacts": {ext: blob}}
+
+
+class VersionNotFound(Exception):
+    """Raised when a version id is not in the store"""
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArtifactStore:
+    """Content-addressed blobs plus version manifests under one root directory"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _blob_path(self, blob):
+        return os.path.join(self.root, "blobs", blob[:2], blob)
+
+    def _version_path(self, version):
+        return os.path.join(self.root, "versions", version[:2], f"{version}.json")
+
+    def _write_once(self, path, write):
+        """Create path with write(temp_path) unless it already exists; contents never change"""
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{threading.get_ident()}.tmp"
+        write(temp)
+        os.replace(temp, path)
+
+    def put_blob(self, src, ext):
+        """Store a file by content; returns its blob name"""
+        blob = _file_digest(src) + ext
+        # A copy, not a link: renderers may later rewrite the output file in place
+        self._write_once(self._blob_path(blob), lambda temp: shutil.copyfile(src, temp))
+        return blob
+
+    def put_version(self, diagram_type, code, artifacts):
+        """Snapshot source and {ext: path} artifacts; returns the version id"""
+        manifest = {
+            "diagram_type": diagram_type,
+            "code": code,
+            "artifacts": {ext: self.put_blob(path, ext) for ext, path in sorted(artifacts.items())},
+        }
+        data = json.dumps(manifest, sort_keys=True).encode("utf-8")
+        version = hashlib.sha256(data).hexdigest()
+
+        def write(temp):
+            with open(temp, 'wb') as f:
+                f.write(data)
+
+        self._write_once(self._version_path(version), write)
+        return version
+
+    def get_version(self, version):
+        """Manifest of a version, with artifact blob names resolved to {ext: path}"""
+        try:
+            with open(self._version_path(version), 'r') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, TypeError):
+            raise VersionNotFound(f"Unknown version: {version}")
+        manifest["artifacts"] = {
+            ext: path for ext, path in
+            ((ext, self._blob_path(blob)) for ext, blob in manifest["artifacts"].items())
+            if os.path.exists(path)
+        }
+        return manifest
+
+    def has_version(self, version):
+        return bool(version) and os.path.exists(self._version_path(version))
+
+    def version_blobs(self, version):
+        """{blob name: size} of the files a version references"""
+        blobs = {}
+        for path in self.get_version(version)["artifacts"].values():
+            blobs[os.path.basename(path)] = os.path.getsize(path)
+        return blobs
+
+    def delete_version(self, version):
+        """Remove a version's manifest; its blobs may still be shared and are removed separately"""
+        try:
+            os.remove(self._version_path(version))
+        except FileNotFoundError:
+            pass
+
+    def delete_blob(self, blob):
+        try:
+            os.remove(self._blob_path(blob))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,209 @@
+import ast
+import re
+
+from graph_ir import d2_strip
+
+# ============================================================================
+#                           RELEVANCE-SLICED EDIT CONTEXT
+# ============================================================================
+# For edits on large diagrams only the lines around the targeted components go
+# to the LLM: their definitions and connections, their neighbours' definitions
+# and the clusters/containers enclosing them. Everything else is replaced by a
+# marker line, and the LLM's answer is spliced back into the full source.
+
+COMMENT_PREFIX = {"cloud": "#", "mermaid": "%%", "d2": "#"}
+MARKER = re.compile(r"^\s*(?:#|%%) \.\.\. \d+ unchanged lines? not shown \.\.\.\s*$")
+MAX_SLICE_RATIO = 0.6  # a slice bigger than this share of the code is not worth it
+
+
+class SliceError(Exception):
+    """Raised when an edited slice cannot be spliced back into the source"""
+
+
+class CodeSlice:
+    """The kept lines of a source file, with a marker for each run of omitted lines"""
+
+    def __init__(self, code, keep, comment):
+        self.lines = code.splitlines()
+        self.trailing_newline = code.endswith("\n")
+        self.keep = sorted(keep)
+        self.comment = comment
+        # Contiguous runs of kept line indexes
+        self.segments = []
+        for index in self.keep:
+            if self.segments and self.segments[-1][-1] == index - 1:
+                self.segments[-1].append(index)
+            else:
+                self.segments.append([index])
+
+    @property
+    def text(self):
+        parts, previous = [], -1
+        for segment in self.segments:
+            if segment[0] > previous + 1:
+                parts.append(self._marker(segment[0] - previous - 1))
+            parts.extend(self.lines[i] for i in segment)
+            previous = segment[-1]
+        if previous < len(self.lines) - 1:
+            parts.append(self._marker(len(self.lines) - 1 - previous))
+        return "\n".join(parts)
+
+    def source_line(self, index):
+        """Source line (0-based) shown at excerpt line `index`; a marker maps to the last line it hides"""
+        positions, previous = [], -1
+        for segment in self.segments:
+            if segment[0] > previous + 1:
+                positions.append(segment[0] - 1)
+            positions.extend(segment)
+            previous = segment[-1]
+        if previous < len(self.lines) - 1:
+            positions.append(len(self.lines) - 1)
+        if not positions:
+            return index
+        return positions[min(index, len(positions) - 1)]
+
+    def _marker(self, count):
+        return f"{self.comment} ... {count} unchanged line{'s' if count != 1 else ''} not shown ..."
+
+    def splice(self, edited):
+        """Put an edited copy of the slice (markers kept in place) back into the full source"""
+        edited_lines = edited.splitlines()
+        markers = [i for i, line in enumerate(edited_lines) if MARKER.match(line)]
+        expected = self.text.splitlines()
+        expected_markers = [i for i, line in enumerate(expected) if MARKER.match(line)]
+        if len(markers) != len(expected_markers):
+            raise SliceError("Edited excerpt does not keep the omitted-code markers")
+        # Segments sit between markers; both lists split the same way
+        bounds = [-1] + markers + [len(edited_lines)]
+        expected_bounds = [-1] + expected_markers + [len(expected)]
+        pieces = [edited_lines[a + 1:b] for a, b in zip(bounds, bounds[1:])]
+        expected_pieces = [expected[a + 1:b] for a, b in zip(expected_bounds, expected_bounds[1:])]
+
+        result, segment_index, cursor = [], 0, 0
+        replacements = {}
+        for piece, original in zip(pieces, expected_pieces):
+            if original:
+                replacements[self.segments[segment_index][0]] = (self.segments[segment_index], piece)
+                segment_index += 1
+            elif piece:
+                raise SliceError("Edited excerpt adds code where none was shown")
+        while cursor < len(self.lines):
+            if cursor in replacements:
+                segment, piece = replacements[cursor]
+                result.extend(piece)
+                cursor = segment[-1] + 1
+            else:
+                result.append(self.lines[cursor])
+                cursor += 1
+        return "\n".join(result) + ("\n" if self.trailing_newline else "")
+
+
+def _mentions(lines, name):
+    token = re.compile(rf"(?<![\w]){re.escape(name)}(?![\w])")
+    return [i for i, line in enumerate(lines) if token.search(line)]
+
+
+def _cloud_structure(code):
+    """(always-kept lines, {line: [enclosing header lines]}, {line: full statement range})"""
+    tree = ast.parse(code)
+    always, enclosing, ranges = set(), {}, {}
+
+    def visit(stmts, headers):
+        for stmt in stmts:
+            span = range(stmt.lineno - 1, stmt.end_lineno)
+            if isinstance(stmt, (ast.Import, ast.ImportFrom)):
+                always.update(span)
+            if isinstance(stmt, ast.With):
+                header = list(range(stmt.lineno - 1, stmt.body[0].lineno - 1))
+                for line in header:
+                    enclosing[line] = headers + header
+                    ranges[line] = header
+                visit(stmt.body, headers + header)
+                continue
+            for line in span:
+                enclosing[line] = headers
+                ranges[line] = list(span)
+
+    visit(tree.body, [])
+    return always, enclosing, ranges
+
+
+def _block_structure(lines, opens, closes):
+    """Enclosing (opener, closer) lines for brace/subgraph style languages"""
+    enclosing, stack, blocks = {}, [], {}
+    for index, line in enumerate(lines):
+        if closes(line) and stack:
+            opener = stack.pop()
+            blocks[opener] = index
+        enclosing[index] = list(stack)
+        if opens(line):
+            stack.append(index)
+    # A kept block line pulls in its openers and their closers; an opener also its own closer
+    return {i: openers + [blocks[o] for o in openers + [i] if o in blocks]
+            for i, openers in enclosing.items()}
+
+
+def slice_for_edit(diagram_type, code, graph, request, min_lines=80):
+    """CodeSlice around the components a request mentions, or None to send the whole code"""
+    lines = code.splitlines()
+    if len(lines) < min_lines or diagram_type not in COMMENT_PREFIX:
+        return None
+    targets = graph.mentioned_in(request)
+    if not targets:
+        return None
+
+    relevant = set()
+    for target in targets:
+        relevant.add(target)
+        if target in graph.groups:
+            relevant.update(graph.members(target))
+    neighbours = {n for r in relevant for n in graph.neighbours(r)} - relevant
+
+    def names(element_id):
+        if diagram_type == "d2":
+            return [element_id.rsplit(".", 1)[-1]]
+        if diagram_type == "cloud" and element_id.startswith("cluster_"):
+            return []
+        return [element_id]
+
+    keep = set()
+    for element_id in relevant:
+        for name in names(element_id):
+            keep.update(_mentions(lines, name))
+        if element_id in graph.groups:
+            label = graph.groups[element_id]["label"]
+            keep.update(i for i, line in enumerate(lines) if label and label in line and (
+                "Cluster" in line or "subgraph" in line or line.rstrip().endswith("{")))
+    for element_id in neighbours:
+        for name in names(element_id):
+            mentions = _mentions(lines, name)
+            if mentions:
+                keep.add(mentions[0])  # its definition, or at least its first appearance
+    if not keep:
+        return None
+
+    if diagram_type == "cloud":
+        try:
+            always, enclosing, ranges = _cloud_structure(code)
+        except SyntaxError:
+            return None
+        for line in list(keep):
+            keep.update(ranges.get(line, []))
+            keep.update(enclosing.get(line, []))
+        keep |= always
+    elif diagram_type == "mermaid":
+        structure = _block_structure(
+            lines, lambda l: l.strip().startswith("subgraph"), lambda l: l.strip() == "end")
+        for line in list(keep):
+            keep.update(structure.get(line, []))
+        keep.add(0)  # graph / flowchart header
+    else:
+        structure = _block_structure(
+            lines, lambda l: d2_strip(l).endswith("{"), lambda l: d2_strip(l) == "}")
+        for line in list(keep):
+            keep.update(structure.get(line, []))
+        keep.update(i for i, l in enumerate(lines) if d2_strip(l).startswith("direction:"))
+
+    if len(keep) > MAX_SLICE_RATIO * len(lines):
+        return None
+    return CodeSlice(code, keep, COMMENT_PREFIX[diagram_type])
@@ -0,0 +1,175 @@
+import html
+import json
+
+# ============================================================================
+#                           GRAPHVIZ LAYOUT -> DRAW.IO
+# ============================================================================
+# Converts the JSON that `dot -Tjson` writes (the layout already computed for
+# the PNG) into mxGraph XML, so no second interpreter or layout pass is needed.
+
+POINTS_PER_INCH = 72
+
+NODE_SHAPES = {
+    "box": "rounded=0;",
+    "rect": "rounded=0;",
+    "rectangle": "rounded=0;",
+    "square": "rounded=0;",
+    "ellipse": "ellipse;",
+    "oval": "ellipse;",
+    "circle": "ellipse;aspect=fixed;",
+    "diamond": "rhombus;",
+    "cylinder": "shape=cylinder3;",
+    "note": "shape=note;",
+}
+
+EDGE_ARROWS = {
+    "forward": "endArrow=classic;",
+    "back": "startArrow=classic;endArrow=none;",
+    "both": "startArrow=classic;endArrow=classic;",
+    "none": "endArrow=none;",
+}
+
+
+def _floats(value):
+    return [float(v) for v in value.split(",")]
+
+
+def _label(obj):
+    label = obj.get("label") or ""
+    # Graphviz escapes: \N is the node name, \n/\l/\r are line breaks
+    if label == "\\N":
+        label = obj.get("name", "")
+    for escape in ("\\n", "\\l", "\\r"):
+        label = label.replace(escape, "\n")
+    return html.escape(label.strip()).replace("\n", "&#xa;")
+
+
+def _color(value, default):
+    return value if value and value.startswith("#") else default
+
+
+class _Converter:
+    def __init__(self, layout):
+        self.layout = layout
+        self.objects = layout.get("objects", [])
+        self.subgraph_count = layout.get("_subgraph_cnt", 0)
+        self.height = _floats(layout.get("bb", "0,0,0,0"))[3]
+        self.cells = []
+        self.origins = {}  # cell id -> absolute (x, y) of its top-left corner
+        self.parents = {}  # gvid -> parent cell id
+
+    def _box(self, bb):
+        llx, lly, urx, ury = _floats(bb)
+        return llx, self.height - ury, urx - llx, ury - lly
+
+    def _geometry(self, parent, x, y, width, height):
+        px, py = self.origins.get(parent, (0, 0))
+        return (f'<mxGeometry x="{x - px:.1f}" y="{y - py:.1f}" '
+                f'width="{width:.1f}" height="{height:.1f}" as="geometry" />')
+
+    def _assign_parents(self):
+        """Nest every node and cluster in its innermost cluster"""
+        def walk(gvid, parent):
+            obj = self.objects[gvid]
+            is_cluster = obj.get("name", "").startswith("cluster")
+            cell = f"c{gvid}" if is_cluster else parent
+            if is_cluster:
+                self.parents[gvid] = parent
+            for node in obj.get("nodes", []):
+                self.parents[node] = cell
+            # "nodes" includes nodes of nested subgraphs; walk those after so the innermost wins
+            for child in obj.get("subgraphs", []):
+                walk(child, cell)
+
+        nested = {child for obj in self.objects[:self.subgraph_count]
+                  for child in obj.get("subgraphs", [])}
+        for gvid in range(self.subgraph_count):
+            if gvid not in nested:
+                walk(gvid, "1")
+
+    def _add_cluster(self, gvid):
+        obj = self.objects[gvid]
+        if "bb" not in obj:
+            return
+        parent = self.parents.get(gvid, "1")
+        x, y, width, height = self._box(obj["bb"])
+        cell_id = f"c{gvid}"
+        style = ("rounded=0;whiteSpace=wrap;html=1;verticalAlign=top;align=left;spacingLeft=6;"
+                 f"fillColor={_color(obj.get('bgcolor'), 'none')};"
+                 f"strokeColor={_color(obj.get('pencolor'), '#666666')};")
+        self.cells.append(
+            f'<mxCell id="{cell_id}" value="{_label(obj)}" style="{style}" vertex="1" parent="{parent}">'
+            f'{self._geometry(parent, x, y, width, height)}</mxCell>'
+        )
+        self.origins[cell_id] = (x, y)
+
+    def _add_node(self, gvid):
+        obj = self.objects[gvid]
+        if "pos" not in obj:
+            return
+        parent = self.parents.get(gvid, "1")
+        cx, cy = _floats(obj["pos"])
+        width = float(obj.get("width", 0.75)) * POINTS_PER_INCH
+        height = float(obj.get("height", 0.5)) * POINTS_PER_INCH
+        shape = NODE_SHAPES.get(obj.get("shape"), "rounded=1;")
+        style = (f"{shape}whiteSpace=wrap;html=1;"
+                 f"fillColor={_color(obj.get('fillcolor'), '#ffffff')};"
+                 f"strokeColor={_color(obj.get('color'), '#000000')};")
+        self.cells.append(
+            f'<mxCell id="n{gvid}" value="{_label(obj)}" style="{style}" vertex="1" parent="{parent}">'
+            f'{self._geometry(parent, cx - width / 2, self.height - cy - height / 2, width, height)}</mxCell>'
+        )
+
+    def _add_edge(self, edge):
+        style = ("html=1;rounded=0;edgeStyle=orthogonalEdgeStyle;"
+                 + EDGE_ARROWS.get(edge.get("dir"), EDGE_ARROWS["forward"])
+                 + f"strokeColor={_color(edge.get('color'), '#000000')};")
+        if edge.get("style") == "dashed":
+            style += "dashed=1;"
+        self.cells.append(
+            f'<mxCell id="e{edge["_gvid"]}" value="{_label(edge)}" style="{style}" edge="1" parent="1" '
+            f'source="n{edge["tail"]}" target="n{edge["head"]}">'
+            f'<mxGeometry relative="1" as="geometry" /></mxCell>'
+        )
+
+    def convert(self):
+        self._assign_parents()
+        # Outer clusters first so their ids exist (and render behind) before their children
+        depth = {}
+        for gvid in range(self.subgraph_count):
+            parent, level = self.parents.get(gvid, "1"), 0
+            while parent != "1":
+                level += 1
+                parent = self.parents.get(int(parent[1:]), "1")
+            depth[gvid] = level
+        for gvid in sorted(depth, key=depth.get):
+            self._add_cluster(gvid)
+        for gvid in range(self.subgraph_count, len(self.objects)):
+            self._add_node(gvid)
+        for edge in self.layout.get("edges", []):
+            self._add_edge(edge)
+
+        name = html.escape(self.layout.get("name") or "Page-1")
+        body = "\n        ".join(self.cells)
+        return f"""<mxfile host="app.diagrams.net">
+  <diagram id="graphviz-1" name="{name}">
+    <mxGraphModel>
+      <root>
+        <mxCell id="0" />
+        <mxCell id="1" parent="0" />
+        {body}
+      </root>
+    </mxGraphModel>
+  </diagram>
+</mxfile>"""
+
+
+def layout_to_drawio(layout):
+    """Build draw.io XML from a parsed `dot -Tjson` layout"""
+    return _Converter(layout).convert()
+
+
+def layout_file_to_drawio(json_path):
+    """Build draw.io XML from a `dot -Tjson` file"""
+    with open(json_path, "r", encoding="utf-8") as f:
+        return layout_to_drawio(json.load(f))
@@ -0,0 +1,91 @@
+import re
+
+# ============================================================================
+#                           UNIFIED DIFF PATCHES
+# ============================================================================
+# Applies the unified diffs the LLM returns for edits to the current source.
+# Hunks are located by their context/removed lines rather than by the line
+# numbers in "@@" headers, which models rarely get right; the header only
+# breaks ties when the same lines occur more than once.
+
+HUNK_HEADER = re.compile(r"^@@\s*-(\d+)(?:,\d+)?\s+\+\d+(?:,\d+)?\s*@@")
+
+
+class PatchError(Exception):
+    """Raised when a diff is malformed or does not match the source"""
+
+
+def extract_diff(reply):
+    """Pull a unified diff out of an LLM reply, or None if it does not contain one"""
+    text = (reply or "").replace("TERMINATE", "")
+    match = re.search(r"```(?:diff|patch)[^\n]*\n(.*?)```", text, re.DOTALL)
+    if match:
+        return match.group(1)
+    if re.search(r"^@@", text, re.MULTILINE):
+        return text
+    return None
+
+
+def parse_hunks(diff):
+    """Unified diff -> [(hinted 0-based start or None, [(op, line), ...])]"""
+    hunks = []
+    current = None
+    for line in diff.splitlines():
+        if line.startswith(("---", "+++")) and current is None:
+            continue
+        if line.startswith("@@"):
+            header = HUNK_HEADER.match(line)
+            current = []
+            hunks.append((int(header.group(1)) - 1 if header else None, current))
+        elif current is None:
+            continue
+        elif line[:1] in ("+", "-", " "):
+            current.append((line[0], line[1:]))
+        elif line.startswith("\\"):
+            continue  # "\ No newline at end of file"
+        else:
+            # Models often drop the leading space of context lines, blank ones in particular
+            current.append((" ", line))
+    hunks = [(hint, ops) for hint, ops in hunks if any(op != " " for op, _ in ops)]
+    if not hunks:
+        raise PatchError("Diff contains no changes")
+    return hunks
+
+
+def _find(lines, block, start, hint):
+    """Index where block occurs in lines at or after start (nearest to hint), else None"""
+    wanted = [line.rstrip() for line in block]
+    matches = [
+        i for i in range(start, len(lines) - len(block) + 1)
+        if [line.rstrip() for line in lines[i:i + len(block)]] == wanted
+    ]
+    if not matches:
+        return None
+    if hint is None:
+        return matches[0]
+    return min(matches, key=lambda i: abs(i - hint))
+
+
+def apply_patch(source, diff, line_map=None):
+    """Apply a unified diff to source and return the patched text.
+
+    line_map translates 0-based header line numbers to source lines when the
+    diff was written against an excerpt (CodeSlice.source_line).
+    """
+    lines = source.splitlines()
+    position = 0
+    for hint, ops in parse_hunks(diff):
+        if line_map is not None and hint is not None and hint >= 0:
+            hint = line_map(hint)
+        old = [line for op, line in ops if op != "+"]
+        new = [line for op, line in ops if op != "-"]
+        if old:
+            index = _find(lines, old, position, hint)
+            if index is None:
+                raise PatchError("Hunk does not match the current code:\n" + "\n".join(old[:5]))
+        else:
+            # A pure insertion's old start names the line to insert after ("-5,0" follows line 5)
+            index = min(max(hint + 1 if hint is not None else len(lines), position), len(lines))
+        lines[index:index + len(old)] = new
+        position = index + len(new)
+    return "\n".join(lines) + ("\n" if source.endswith("\n") else "")
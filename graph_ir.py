@@ -0,0 +1,475 @@
+import ast
+import re
+
+# ============================================================================
+#                           GRAPH INTERMEDIATE REPRESENTATION
+# ============================================================================
+# One graph model (nodes, edges, groups, attributes) for all three diagram
+# languages. Parsed once per iteration and stored in the session, so lookups
+# by id, label or kind are dictionary hits instead of regex scans of the code.
+
+SKIP_CLASSES = {"Diagram", "Cluster", "Edge"}
+EDGE_ATTRIBUTES = ("label", "color", "style")
+
+MERMAID_ID = r"[A-Za-z_][\w]*"
+MERMAID_SHAPE = re.compile(
+    rf"({MERMAID_ID})\s*(\(\(.*?\)\)|\[\[.*?\]\]|\[\(.*?\)\]|\(\[.*?\]\)|\{{\{{.*?\}}\}}"
+    r"|\[/.*?/\]|\[\\.*?\\\]|\[.*?\]|\(.*?\)|\{.*?\}|>.*?\])"
+)
+MERMAID_ARROW = re.compile(
+    r"\s*((?:--|==)\s[^|>]+?\s(?:-{2,}|={2,})[>xo]?"
+    r"|[<xo]?(?:-{2,}|={2,}|-\.+-?)[>xo]?(?:\|[^|]*\|)?)\s*"
+)
+MERMAID_SHAPES = {
+    "[": "rect", "(": "round", "((": "circle", "[(": "cylinder", "([": "stadium", "[[": "subroutine",
+    "{": "diamond", "{{": "hexagon", ">": "flag", "[/": "parallelogram", "[\\": "parallelogram",
+}
+MERMAID_KEYWORDS = {"graph", "flowchart", "subgraph", "end", "style", "class", "classDef", "click", "linkStyle", "direction"}
+
+D2_ARROW = re.compile(r"\s*(<->|->|<-|--)\s*")
+D2_KEY = r"\"[^\"]+\"|[\w\-\.]+"
+D2_RESERVED = {
+    "style", "shape", "icon", "label", "width", "height", "near", "link", "tooltip",
+    "direction", "vars", "classes", "class", "constraint", "grid-rows", "grid-columns",
+}
+
+GENERIC_WORDS = {
+    "bucket", "buckets", "instance", "instances", "database", "databases", "db",
+    "function", "functions", "table", "tables", "node", "nodes", "service", "services",
+    "server", "servers", "component", "components", "box", "boxes", "queue", "topic",
+}
+LEADING_WORDS = {"the", "a", "an", "all", "both", "my", "our"}
+
+
+def normalize_name(text):
+    return re.sub(r"[^a-z0-9]", "", (text or "").lower())
+
+
+def target_forms(phrase):
+    """Normalized spellings a phrase like "the S3 buckets" may refer to: s3buckets, s3bucket, s3"""
+    words = re.findall(r"[a-z0-9_\-]+", phrase.lower())
+    while words and words[0] in LEADING_WORDS:
+        words = words[1:]
+    forms = {normalize_name(" ".join(words))}
+    stripped = list(words)
+    while len(stripped) > 1 and stripped[-1] in GENERIC_WORDS:
+        stripped = stripped[:-1]
+    forms.add(normalize_name(" ".join(stripped)))
+    forms.update({f[:-1] for f in list(forms) if f.endswith("s") and len(f) > 3})
+    forms.discard("")
+    return forms
+
+
+class Graph:
+    """Nodes, edges and groups of one diagram, with indexes for lookups"""
+
+    def __init__(self, diagram_type=None):
+        self.diagram_type = diagram_type
+        self.nodes = {}   # id -> {"label", "kind", "group", "attrs"}
+        self.groups = {}  # id -> {"label", "parent", "attrs"}
+        self.edges = []   # {"source", "target", "label", "attrs"}
+        self._index = None
+
+    def add_node(self, node_id, label=None, kind="", group=None, **attrs):
+        node = self.nodes.setdefault(node_id, {"label": node_id, "kind": kind, "group": group, "attrs": {}})
+        if label:
+            node["label"] = label
+        node["kind"] = kind or node["kind"]
+        node["group"] = group if group is not None else node["group"]
+        node["attrs"].update(attrs)
+        self._index = None
+        return node
+
+    def add_group(self, group_id, label=None, parent=None, **attrs):
+        group = self.groups.setdefault(group_id, {"label": group_id, "parent": parent, "attrs": {}})
+        if label:
+            group["label"] = label
+        group["parent"] = parent if parent is not None else group["parent"]
+        group["attrs"].update(attrs)
+        self._index = None
+        return group
+
+    def add_edge(self, source, target, label="", **attrs):
+        self.edges.append({"source": source, "target": target, "label": label or "", "attrs": attrs})
+        self._index = None
+
+    def _build_index(self):
+        if self._index is None:
+            by_name, by_kind, adjacency = {}, {}, {}
+            for element_id, element in list(self.nodes.items()) + list(self.groups.items()):
+                # A nested D2 shape "aws.lb" also answers to "lb"
+                names = {normalize_name(n) for n in (element_id, element["label"], element_id.rsplit(".", 1)[-1])}
+                for name in names:
+                    by_name.setdefault(name, []).append(element_id)
+                if element.get("kind"):
+                    by_kind.setdefault(normalize_name(element["kind"]), []).append(element_id)
+            for position, edge in enumerate(self.edges):
+                adjacency.setdefault(edge["source"], []).append(position)
+                adjacency.setdefault(edge["target"], []).append(position)
+            self._index = (by_name, by_kind, adjacency)
+        return self._index
+
+    def label(self, element_id):
+        element = self.nodes.get(element_id) or self.groups.get(element_id) or {}
+        return element.get("label") or element_id
+
+    def find(self, phrase):
+        """Ids of nodes/groups a phrase names: by id or label first, then by kind (e.g. "S3")"""
+        by_name, by_kind, _ = self._build_index()
+        forms = target_forms(phrase)
+        for index in (by_name, by_kind):
+            found = []
+            for form in forms:
+                found.extend(i for i in index.get(form, []) if i not in found)
+            if found:
+                return found
+        return []
+
+    def mentioned_in(self, text):
+        """Ids of nodes/groups whose id, label or kind appears in free text"""
+        by_name, by_kind, _ = self._build_index()
+        words = re.findall(r"[a-z0-9_\-]+", text.lower())
+        phrases = {normalize_name(" ".join(words[i:i + n])) for n in (1, 2, 3) for i in range(len(words))}
+        found = []
+        for index in (by_name, by_kind):
+            for phrase in phrases:
+                found.extend(i for i in index.get(phrase, []) if i not in found)
+        return found
+
+    def edges_of(self, element_id):
+        _, _, adjacency = self._build_index()
+        return [self.edges[i] for i in adjacency.get(element_id, [])]
+
+    def neighbours(self, element_id):
+        return {e["target"] if e["source"] == element_id else e["source"] for e in self.edges_of(element_id)}
+
+    def members(self, group_id):
+        """Node ids inside a group, including nested groups"""
+        return [n for n, node in self.nodes.items() if group_id in self.group_path(node["group"])]
+
+    def group_path(self, group_id):
+        """[outermost, ..., group_id] for a group id (empty for None)"""
+        path = []
+        while group_id is not None and group_id not in path:
+            path.insert(0, group_id)
+            group_id = self.groups.get(group_id, {}).get("parent")
+        return path
+
+    def to_dict(self):
+        def compact(items):
+            return {k: {f: v for f, v in item.items() if v or f == "label"} for k, item in items.items()}
+        return {
+            "nodes": compact(self.nodes),
+            "groups": compact(self.groups),
+            "edges": [{f: v for f, v in edge.items() if v or f in ("source", "target")} for edge in self.edges],
+        }
+
+    @classmethod
+    def from_dict(cls, data, diagram_type=None):
+        graph = cls(diagram_type)
+        for group_id, group in data.get("groups", {}).items():
+            graph.add_group(group_id, group.get("label"), group.get("parent"), **group.get("attrs", {}))
+        for node_id, node in data.get("nodes", {}).items():
+            graph.add_node(node_id, node.get("label"), node.get("kind", ""), node.get("group"), **node.get("attrs", {}))
+        for edge in data.get("edges", []):
+            graph.add_edge(edge["source"], edge["target"], edge.get("label", ""), **edge.get("attrs", {}))
+        return graph
+
+
+# ----------------------------------------------------------------------------
+#  Python `diagrams` code
+# ----------------------------------------------------------------------------
+
+def call_name(call):
+    func = call.func
+    if isinstance(func, ast.Name):
+        return func.id
+    if isinstance(func, ast.Attribute):
+        return func.attr
+    return None
+
+
+def call_label(call):
+    """The Constant node holding a node/cluster label, or None"""
+    for keyword in call.keywords:
+        if keyword.arg == "label" and isinstance(keyword.value, ast.Constant):
+            return keyword.value
+    if call.args and isinstance(call.args[0], ast.Constant) and isinstance(call.args[0].value, str):
+        return call.args[0]
+    return None
+
+
+def cluster_call(stmt):
+    if isinstance(stmt, ast.With) and len(stmt.items) == 1:
+        call = stmt.items[0].context_expr
+        if isinstance(call, ast.Call) and call_name(call) == "Cluster":
+            return call
+    return None
+
+
+def cluster_id(stmt):
+    return f"cluster_{stmt.lineno}"
+
+
+def chain_parts(expr):
+    """a >> b << [c, d] -> ([a, b, [c, d]], [">>", "<<"]) for >>, << and - chains"""
+    ops = {ast.RShift: ">>", ast.LShift: "<<", ast.Sub: "-"}
+    if isinstance(expr, ast.BinOp) and type(expr.op) in ops:
+        operands, symbols = chain_parts(expr.left)
+        right, right_symbols = chain_parts(expr.right)
+        return operands + right, symbols + [ops[type(expr.op)]] + right_symbols
+    return [expr], []
+
+
+def names_in(node):
+    return {n.id for n in ast.walk(node) if isinstance(n, ast.Name)}
+
+
+def _constant_kwargs(call):
+    return {k.arg: k.value.value for k in call.keywords
+            if k.arg in EDGE_ATTRIBUTES and isinstance(k.value, ast.Constant)}
+
+
+def parse_cloud(code):
+    graph = Graph("cloud")
+    aliases = {}  # list variable -> node ids
+
+    def resolve(operand):
+        if isinstance(operand, ast.Name):
+            return aliases.get(operand.id, [operand.id] if operand.id in graph.nodes else [])
+        if isinstance(operand, (ast.List, ast.Tuple)):
+            return [n for element in operand.elts for n in resolve(element)]
+        return []
+
+    def add_chain(expr):
+        operands, symbols = chain_parts(expr)
+        previous, edge_attrs, op = None, {}, None
+        for index, operand in enumerate(operands):
+            if index:
+                op = op or symbols[index - 1]
+            if isinstance(operand, ast.Call) and call_name(operand) == "Edge":
+                edge_attrs.update(_constant_kwargs(operand))
+                continue
+            current = resolve(operand)
+            if previous is not None:
+                attrs = {k: v for k, v in edge_attrs.items() if k != "label"}
+                if op == "-":
+                    attrs["dir"] = "none"
+                for left in previous:
+                    for right in current:
+                        source, target = (right, left) if op == "<<" else (left, right)
+                        graph.add_edge(source, target, edge_attrs.get("label", ""), **attrs)
+            previous, edge_attrs, op = current, {}, None
+
+    def visit(stmts, group):
+        for stmt in stmts:
+            if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name):
+                target, value = stmt.targets[0].id, stmt.value
+                if isinstance(value, ast.Call) and call_name(value) not in SKIP_CLASSES:
+                    label = call_label(value)
+                    graph.add_node(target, label.value if label is not None else target, call_name(value), group)
+                elif isinstance(value, (ast.List, ast.Tuple)):
+                    aliases[target] = resolve(value)
+                elif isinstance(value, ast.BinOp):
+                    add_chain(value)
+            elif isinstance(stmt, ast.With):
+                call = cluster_call(stmt)
+                if call is not None:
+                    label = call_label(call)
+                    graph.add_group(cluster_id(stmt), label.value if label is not None else "", group)
+                    visit(stmt.body, cluster_id(stmt))
+                else:
+                    visit(stmt.body, group)
+            elif isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.BinOp):
+                add_chain(stmt.value)
+            elif isinstance(stmt, (ast.For, ast.If)):
+                visit(stmt.body, group)
+
+    visit(ast.parse(code).body, None)
+    return graph
+
+
+# ----------------------------------------------------------------------------
+#  Mermaid
+# ----------------------------------------------------------------------------
+
+def mermaid_shape(shape):
+    opener = re.match(r"\(\(|\[\[|\[\(|\(\[|\{\{|\[/|\[\\|\[|\(|\{|>", shape).group(0)
+    return MERMAID_SHAPES[opener]
+
+
+def mermaid_label(shape):
+    inner = re.sub(r"^[\[\(\{>/\\]+|[\]\)\}/\\]+$", "", shape).strip()
+    return inner.strip('"')
+
+
+def mask_labels(line):
+    """Hide node labels so arrows inside them are not split on; returns (masked, labels)"""
+    labels = []
+
+    def hide(match):
+        labels.append(match.group(2))
+        return f"{match.group(1)}\x00{len(labels) - 1}\x00"
+    return MERMAID_SHAPE.sub(hide, line), labels
+
+
+def unmask_labels(text, labels):
+    return re.sub(r"\x00(\d+)\x00", lambda m: labels[int(m.group(1))], text)
+
+
+def mermaid_operand_ids(operand):
+    """Node ids of one side of a connection: "A[x] & B" -> ["A", "B"]"""
+    return [re.sub(r"\x00\d+\x00", "", part).strip() for part in operand.split("&") if part.strip()]
+
+
+def _arrow_label(arrow):
+    match = re.search(r"\|([^|]*)\||^(?:--|==)\s(.+?)\s", arrow.strip())
+    return (match.group(1) or match.group(2)).strip() if match else ""
+
+
+def parse_mermaid(code):
+    graph = Graph("mermaid")
+    lines = code.splitlines()
+    header = next((l.strip() for l in lines if l.strip() and not l.strip().startswith("%%")), "")
+    if not re.match(r"(graph|flowchart)\b", header):
+        # Other Mermaid diagram types: nodes only
+        for match in re.finditer(r"(\w+)[\[\(].*?[\]\)]", code):
+            graph.add_node(match.group(1))
+        return graph
+
+    groups = []
+    for line in lines[1:]:
+        stripped = line.strip()
+        first = stripped.split(" ", 1)[0] if stripped else ""
+        if first == "subgraph":
+            match = re.match(rf"subgraph\s+({MERMAID_ID})\s*\[(.*?)\]\s*$", stripped)
+            group_id, label = (match.group(1), match.group(2).strip('"')) if match else \
+                (normalize_name(stripped[9:]) or f"subgraph_{len(graph.groups)}", stripped[9:].strip().strip('"'))
+            graph.add_group(group_id, label, groups[-1] if groups else None)
+            groups.append(group_id)
+            continue
+        if first == "end":
+            if groups:
+                groups.pop()
+            continue
+        if not stripped or stripped.startswith("%%") or first in MERMAID_KEYWORDS:
+            continue
+        group = groups[-1] if groups else None
+        masked, labels = mask_labels(stripped)
+        for match in MERMAID_SHAPE.finditer(stripped):
+            graph.add_node(match.group(1), mermaid_label(match.group(2)), group=group, shape=mermaid_shape(match.group(2)))
+        pieces = MERMAID_ARROW.split(masked)
+        operands, arrows = pieces[0::2], pieces[1::2]
+        sides = [mermaid_operand_ids(o) for o in operands]
+        for ids in sides:
+            for node_id in ids:
+                if re.fullmatch(MERMAID_ID, node_id) and node_id not in graph.nodes:
+                    graph.add_node(node_id, group=group)
+        for index, arrow in enumerate(arrows):
+            for source in sides[index]:
+                for target in sides[index + 1]:
+                    graph.add_edge(source, target, _arrow_label(arrow))
+    return graph
+
+
+# ----------------------------------------------------------------------------
+#  D2
+# ----------------------------------------------------------------------------
+
+def d2_strip(line):
+    """Line without its comment ("#" that starts a word, so "#ff0000" colors survive)"""
+    return re.sub(r"(^|\s)#.*$", "", line).strip()
+
+
+def d2_lines(lines):
+    """(index, stripped, container path) per line; container is None inside blocks like style: {"""
+    stack = []
+    for index, line in enumerate(lines):
+        stripped = d2_strip(line)
+        container = None if "\x00" in stack else ".".join(stack)
+        yield index, stripped, container
+        if stripped == "}":
+            if stack:
+                stack.pop()
+        elif stripped.endswith("{"):
+            match = re.match(rf"^({D2_KEY})\s*(?::.*)?\{{$", stripped)
+            key = match.group(1).strip('"') if match else ""
+            is_shape = (match and container is not None and not D2_ARROW.search(stripped)
+                        and key.rsplit(".", 1)[-1] not in D2_RESERVED)
+            stack.append(key if is_shape else "\x00")
+
+
+def d2_value(value):
+    """Label part of a D2 value, without an inline block: Database {shape: cylinder} -> Database"""
+    return re.sub(r"\s*\{.*\}\s*$", "", value).strip().strip('"')
+
+
+def d2_full_path(container, key):
+    key = key.strip().strip('"')
+    return f"{container}.{key}" if container else key
+
+
+def parse_d2(code):
+    graph = Graph("d2")
+    labels, attrs, edges = {}, {}, []
+    lines = code.splitlines()
+    for _, stripped, container in d2_lines(lines):
+        if not stripped or stripped == "}" or container is None:
+            continue
+        body = stripped.rstrip("{").strip()
+        key_part, _, value = body.partition(":")
+        if D2_ARROW.search(key_part):
+            pieces = D2_ARROW.split(key_part)
+            operands, arrows = pieces[0::2], pieces[1::2]
+            paths = [d2_full_path(container, o) for o in operands]
+            for path in paths:
+                labels.setdefault(path, "")
+            for index, arrow in enumerate(arrows):
+                source, target = paths[index], paths[index + 1]
+                if arrow == "<-":
+                    source, target = target, source
+                extra = {"dir": "both"} if arrow == "<->" else {"dir": "none"} if arrow == "--" else {}
+                edges.append((source, target, d2_value(value), extra))
+            continue
+        key = key_part.strip().strip('"')
+        segments = key.split(".")
+        reserved = [i for i, s in enumerate(segments) if s in D2_RESERVED]
+        if reserved:
+            # shape.style.fill: red / shape: cylinder inside a block
+            owner = d2_full_path(container, ".".join(segments[:reserved[0]])) if reserved[0] else container
+            if owner:
+                attrs.setdefault(owner, {})[".".join(segments[reserved[0]:])] = value.strip().strip('"')
+            continue
+        path = d2_full_path(container, key)
+        label = d2_value(value)
+        if label or path not in labels:
+            labels[path] = label
+
+    containers = {p.rsplit(".", 1)[0] for p in labels if "." in p}
+    containers |= {c for p in containers for c in [".".join(p.split(".")[:i]) for i in range(1, p.count(".") + 1)]}
+    for path in sorted(containers, key=lambda p: p.count(".")):
+        parent = path.rsplit(".", 1)[0] if "." in path else None
+        graph.add_group(path, labels.get(path) or path.rsplit(".", 1)[-1], parent, **attrs.get(path, {}))
+    for path, label in labels.items():
+        if path in containers:
+            continue
+        parent = path.rsplit(".", 1)[0] if "." in path else None
+        node_attrs = attrs.get(path, {})
+        graph.add_node(path, label or path.rsplit(".", 1)[-1], node_attrs.get("shape", ""), parent, **node_attrs)
+    for source, target, label, extra in edges:
+        graph.add_edge(source, target, label, **extra)
+    return graph
+
+
+PARSERS = {"cloud": parse_cloud, "mermaid": parse_mermaid, "d2": parse_d2}
+
+
+def parse_graph(diagram_type, code):
+    """Graph for diagram source; an empty graph when the source does not parse"""
+    graph = Graph(diagram_type)
+    if code and diagram_type in PARSERS:
+        try:
+            graph = PARSERS[diagram_type](code)
+        except (SyntaxError, ValueError):
+            pass
+    return graph
@@ -0,0 +1,315 @@
+import os
+import time
+import sqlite3
+import threading
+
+# ============================================================================
+#                           STORAGE JANITOR
+# ============================================================================
+# Background cleanup of sessions, their output files and their snapshots in
+# the artifact store. Everything is tracked in a small SQLite index as it is
+# written, so a cleanup pass is a few indexed queries plus the deletions
+# themselves, never a directory walk. Each pass deletes at most `batch` files
+# and picks up where it left off on the next one:
+#
+#   1. sessions unused for longer than the TTL are deleted outright
+#   2. sessions over their quota lose their oldest snapshots (undo depth)
+#   3. while the total is over the global quota, least recently used
+#      sessions are deleted
+#
+# Snapshots are shared between sessions, so versions and blobs are reference
+# counted and only removed once nothing points at them.
+
+ACTIVE_GRACE = 3600  # seconds; the global quota never evicts a session used this recently
+
+
+class Janitor:
+    """Index of stored files per session, and the cleanup passes that run over it"""
+
+    def __init__(self, index_path, artifact_store, delete_session, ttl, session_quota, global_quota,
+                 interval=300, batch=200, output_dir="output"):
+        self.index_path = index_path
+        self.artifact_store = artifact_store
+        self.delete_session = delete_session  # removes a session from the session store
+        self.ttl = ttl
+        self.session_quota = session_quota
+        self.global_quota = global_quota
+        self.interval = interval
+        self.batch = batch
+        self.output_dir = output_dir
+        self.lock = threading.RLock()
+        self.conn = None
+        self.thread = None
+
+    def _db(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(self.index_path, timeout=30, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, last_used REAL NOT NULL, bytes INTEGER NOT NULL DEFAULT 0);"
+                "CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used);"
+                "CREATE INDEX IF NOT EXISTS sessions_bytes ON sessions (bytes);"
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, session_id TEXT NOT NULL, size INTEGER NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS files_session ON files (session_id);"
+                "CREATE TABLE IF NOT EXISTS refs ("
+                "session_id TEXT NOT NULL, version TEXT NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (session_id, version));"
+                "CREATE INDEX IF NOT EXISTS refs_version ON refs (version);"
+                "CREATE INDEX IF NOT EXISTS refs_session_age ON refs (session_id, created_at);"
+                "CREATE TABLE IF NOT EXISTS version_blobs ("
+                "version TEXT NOT NULL, blob TEXT NOT NULL, PRIMARY KEY (version, blob));"
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "blob TEXT PRIMARY KEY, size INTEGER NOT NULL, refs INTEGER NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+            )
+        return self.conn
+
+    # ------------------------------------------------------------------ index
+
+    def snapshot(self, session_id, diagram_type, code, artifacts):
+        """Store an iteration in the artifact store and index it; returns the version id.
+
+        Done under the janitor lock so a cleanup pass cannot remove a version
+        or blob between the store finding it present and the index counting it.
+        """
+        with self.lock:
+            version = self.artifact_store.put_version(diagram_type, code, artifacts)
+            self.record(session_id, version, artifacts)
+        self.start()
+        return version
+
+    def record(self, session_id, version, artifacts, earlier=()):
+        """Index a session's current output files and a version it references.
+
+        `earlier` are older versions the session also references (a branch's
+        steps inherited from its parent), oldest first; they are indexed as
+        older than `version`, so trimming drops them first.
+        """
+        now = time.time()
+        with self.lock:
+            db = self._db()
+            with db:
+                db.execute(
+                    "INSERT INTO sessions (session_id, last_used) VALUES (?, ?) "
+                    "ON CONFLICT (session_id) DO UPDATE SET last_used = excluded.last_used",
+                    (session_id, now)
+                )
+                for path in artifacts.values():
+                    if os.path.exists(path):
+                        db.execute(
+                            "INSERT OR REPLACE INTO files (path, session_id, size) VALUES (?, ?, ?)",
+                            (path, session_id, os.path.getsize(path))
+                        )
+                for age, earlier_version in enumerate(reversed(list(earlier)), 1):
+                    if earlier_version != version:
+                        self._add_ref(db, session_id, earlier_version, now - age * 0.001)
+                if version:
+                    self._add_ref(db, session_id, version, now)
+                self._update_bytes(db, session_id)
+
+    def _add_ref(self, db, session_id, version, now):
+        known = db.execute("SELECT 1 FROM refs WHERE version = ? LIMIT 1", (version,)).fetchone()
+        db.execute(
+            "INSERT INTO refs (session_id, version, created_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (session_id, version) DO UPDATE SET created_at = excluded.created_at",
+            (session_id, version, now)
+        )
+        if known:
+            return
+        for blob, size in self.artifact_store.version_blobs(version).items():
+            inserted = db.execute(
+                "INSERT OR IGNORE INTO version_blobs (version, blob) VALUES (?, ?)", (version, blob)
+            ).rowcount
+            if inserted:
+                db.execute(
+                    "INSERT INTO blobs (blob, size, refs) VALUES (?, ?, 1) "
+                    "ON CONFLICT (blob) DO UPDATE SET refs = refs + 1",
+                    (blob, size)
+                )
+
+    def _update_bytes(self, db, session_id):
+        files = db.execute("SELECT COALESCE(SUM(size), 0) FROM files WHERE session_id = ?", (session_id,)).fetchone()[0]
+        snapshots = db.execute(
+            "SELECT COALESCE(SUM(b.size), 0) FROM refs r "
+            "JOIN version_blobs vb ON vb.version = r.version JOIN blobs b ON b.blob = vb.blob "
+            "WHERE r.session_id = ?", (session_id,)
+        ).fetchone()[0]
+        db.execute("UPDATE sessions SET bytes = ? WHERE session_id = ?", (files + snapshots, session_id))
+
+    def backfill(self):
+        """Index output files written before the janitor existed, once.
+
+        They cannot be tied to a session, so each diagram's files form their own
+        entry, aged by modification time, and expire under the same TTL.
+        """
+        with self.lock:
+            db = self._db()
+            if db.execute("SELECT 1 FROM meta WHERE key = 'backfilled'").fetchone():
+                return
+            with db:
+                if os.path.isdir(self.output_dir):
+                    for entry in os.scandir(self.output_dir):
+                        if not entry.is_file() or entry.name.endswith(".tmp"):
+                            continue
+                        stat = entry.stat()
+                        owner = "orphan:" + entry.name.split(".", 1)[0]
+                        inserted = db.execute(
+                            "INSERT OR IGNORE INTO files (path, session_id, size) VALUES (?, ?, ?)",
+                            (os.path.join(self.output_dir, entry.name), owner, stat.st_size)
+                        ).rowcount
+                        if not inserted:
+                            continue  # already indexed for its session
+                        db.execute(
+                            "INSERT INTO sessions (session_id, last_used, bytes) VALUES (?, ?, ?) "
+                            "ON CONFLICT (session_id) DO UPDATE SET bytes = bytes + excluded.bytes, "
+                            "last_used = MAX(last_used, excluded.last_used)",
+                            (owner, stat.st_mtime, stat.st_size)
+                        )
+                db.execute("INSERT INTO meta (key, value) VALUES ('backfilled', ?)", (str(time.time()),))
+
+    # ---------------------------------------------------------------- deletion
+
+    def _drop_ref(self, db, session_id, version):
+        """Remove one session->version reference; returns the number of files deleted"""
+        db.execute("DELETE FROM refs WHERE session_id = ? AND version = ?", (session_id, version))
+        if db.execute("SELECT 1 FROM refs WHERE version = ? LIMIT 1", (version,)).fetchone():
+            return 0
+        deleted = 1
+        self.artifact_store.delete_version(version)
+        blobs = [blob for (blob,) in db.execute("SELECT blob FROM version_blobs WHERE version = ?", (version,))]
+        db.execute("DELETE FROM version_blobs WHERE version = ?", (version,))
+        for blob in blobs:
+            db.execute("UPDATE blobs SET refs = refs - 1 WHERE blob = ?", (blob,))
+            if db.execute("SELECT refs FROM blobs WHERE blob = ?", (blob,)).fetchone()[0] <= 0:
+                db.execute("DELETE FROM blobs WHERE blob = ?", (blob,))
+                self.artifact_store.delete_blob(blob)
+                deleted += 1
+        return deleted
+
+    def expire(self, session_id, budget=None):
+        """Delete a session with its files and snapshots; returns files deleted.
+
+        With a budget the session may only be partly removed; the rest goes on
+        a later pass, and the session store entry goes last.
+        """
+        budget = self.batch if budget is None else budget
+        deleted = 0
+        with self.lock:
+            db = self._db()
+            with db:
+                for (path,) in db.execute(
+                    "SELECT path FROM files WHERE session_id = ? LIMIT ?", (session_id, budget)
+                ).fetchall():
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    db.execute("DELETE FROM files WHERE path = ?", (path,))
+                    deleted += 1
+                for (version,) in db.execute(
+                    "SELECT version FROM refs WHERE session_id = ? LIMIT ?", (session_id, max(budget - deleted, 0))
+                ).fetchall():
+                    deleted += self._drop_ref(db, session_id, version)
+                done = not self.indexed(session_id)
+                if done:
+                    db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                else:
+                    self._update_bytes(db, session_id)
+            if done and not session_id.startswith("orphan:"):
+                self.delete_session(session_id)
+        return deleted
+
+    def indexed(self, session_id):
+        """Whether any files or snapshot references are still indexed for a session"""
+        with self.lock:
+            return self._db().execute(
+                "SELECT 1 FROM files WHERE session_id = ? UNION ALL SELECT 1 FROM refs WHERE session_id = ? LIMIT 1",
+                (session_id, session_id)
+            ).fetchone() is not None
+
+    def trim(self, session_id, budget):
+        """Drop a session's oldest snapshots (never the newest) until it fits its quota"""
+        deleted = 0
+        with self.lock:
+            db = self._db()
+            with db:
+                versions = [version for (version,) in db.execute(
+                    "SELECT version FROM refs WHERE session_id = ? ORDER BY created_at", (session_id,)
+                )][:-1]
+                for version in versions:
+                    size = db.execute("SELECT bytes FROM sessions WHERE session_id = ?", (session_id,)).fetchone()[0]
+                    if size <= self.session_quota or deleted >= budget:
+                        break
+                    deleted += self._drop_ref(db, session_id, version)
+                    self._update_bytes(db, session_id)
+        return deleted
+
+    def total_bytes(self):
+        with self.lock:
+            db = self._db()
+            files = db.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+            blobs = db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        return files + blobs
+
+    def collect(self):
+        """One incremental cleanup pass; returns the number of files deleted"""
+        budget = self.batch
+        now = time.time()
+        with self.lock:
+            db = self._db()
+            expired = [session_id for (session_id,) in db.execute(
+                "SELECT session_id FROM sessions WHERE last_used < ? ORDER BY last_used LIMIT ?",
+                (now - self.ttl, budget)
+            )] if self.ttl > 0 else []
+            over_quota = [session_id for (session_id,) in db.execute(
+                "SELECT session_id FROM sessions WHERE bytes > ? ORDER BY bytes DESC LIMIT ?",
+                (self.session_quota, budget)
+            )] if self.session_quota > 0 else []
+        for session_id in expired:
+            if budget <= 0:
+                return self.batch
+            budget -= self.expire(session_id, budget)
+        for session_id in over_quota:
+            if budget <= 0:
+                return self.batch
+            budget -= self.trim(session_id, budget)
+        while self.global_quota > 0 and budget > 0 and self.total_bytes() > self.global_quota:
+            with self.lock:
+                row = self._db().execute(
+                    "SELECT session_id FROM sessions WHERE last_used < ? ORDER BY last_used LIMIT 1",
+                    (now - ACTIVE_GRACE,)
+                ).fetchone()
+            if row is None:
+                break
+            budget -= self.expire(row[0], budget)
+        return self.batch - budget
+
+    # -------------------------------------------------------------- background
+
+    def start(self, interval=None):
+        """Run collect() every interval seconds on a daemon thread (once per process)"""
+        interval = self.interval if interval is None else interval
+        if interval <= 0 or self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, args=(interval,), name="janitor", daemon=True)
+            self.thread.start()
+
+    def _run(self, interval):
+        try:
+            self.backfill()
+        except Exception as e:
+            print(f"Janitor backfill failed: {e}")
+        while True:
+            time.sleep(interval)
+            try:
+                # A full batch means there is more to do: go again without waiting
+                while self.collect() >= self.batch:
+                    pass
+            except Exception as e:
+                print(f"Janitor pass failed: {e}")
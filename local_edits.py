@@ -0,0 +1,509 @@
+import ast
+import json
+import re
+
+from graph_ir import (
+    parse_cloud, parse_mermaid, parse_d2, call_name, call_label, cluster_call, cluster_id, chain_parts, names_in,
+    mask_labels, unmask_labels, mermaid_operand_ids, d2_lines, d2_strip, d2_full_path, D2_ARROW, D2_KEY, MERMAID_ARROW, MERMAID_KEYWORDS,
+)
+
+# ============================================================================
+#                           LOCAL STRUCTURAL EDITS
+# ============================================================================
+# "remove the S3 bucket" / "rename web to Frontend" are applied to the current
+# source directly, without an LLM round trip. Anything this module is not sure
+# about raises LocalEditError and the caller falls back to the LLM.
+
+# Requests that mention these do more than remove/rename a component
+COMPOUND_WORDS = {
+    "add", "and then", "then", "replace", "instead", "connect", "connection", "edge", "edges",
+    "arrow", "arrows", "link", "links", "move", "but", "except", "between", "color", "colour", "style",
+}
+
+
+class LocalEditError(Exception):
+    """Raised when an edit cannot be applied safely without the LLM"""
+
+
+def parse_edit_request(request):
+    """("remove", [targets]) or ("rename", target, new_label) for simple edits, else None"""
+    text = " ".join(request.strip().rstrip(".!").split())
+    lower = text.lower()
+    lower = re.sub(r"^(?:please\s+|can you\s+|could you\s+|now\s+)+", "", lower)
+    offset = len(text) - len(lower)
+
+    match = re.match(r"rename\s+(.+?)\s+(?:to|as)\s+(.+)$", lower)
+    if match:
+        new_label = text[offset + match.start(2):].strip().strip("\"'")
+        if not new_label:
+            return None
+        return "rename", match.group(1).strip().strip("\"'"), new_label
+
+    match = re.match(r"(?:remove|delete|drop)\s+(.+?)(?:\s+(?:from|in)\s+(?:the\s+)?(?:diagram|chart|graph))?$", lower)
+    if not match:
+        return None
+    words = set(re.findall(r"[a-z]+", match.group(1)))
+    if words & COMPOUND_WORDS or " and then " in lower:
+        return None
+    targets = [t.strip().strip("\"'") for t in re.split(r",|\band\b|&", match.group(1))]
+    targets = [t for t in targets if t]
+    return ("remove", targets) if targets else None
+
+
+def _resolve(graph, targets):
+    """Element ids per target phrase via the graph's name/kind index"""
+    resolved = []
+    for target in targets:
+        found = graph.find(target)
+        if not found:
+            raise LocalEditError(f"No component matches '{target}'")
+        resolved.append(found)
+    return resolved
+
+
+def _resolve_one(graph, target):
+    found = graph.find(target)
+    if len(found) != 1:
+        raise LocalEditError(f"'{target}' matches {len(found)} components")
+    return found[0]
+
+
+# ----------------------------------------------------------------------------
+#  Python `diagrams` code (AST)
+# ----------------------------------------------------------------------------
+
+class _CloudSource:
+    """Parsed diagrams script plus the nodes and clusters it defines"""
+
+    def __init__(self, code):
+        try:
+            self.tree = ast.parse(code)
+        except SyntaxError as e:
+            raise LocalEditError(f"Current code does not parse: {e}")
+        self.code = code
+        self.line_starts = [0]
+        for line in code.splitlines(keepends=True):
+            self.line_starts.append(self.line_starts[-1] + len(line))
+        self.graph = parse_cloud(code)
+        self.nodes = {}     # variable -> Call
+        self.clusters = {}  # group id -> (With, Call)
+        for stmt in ast.walk(self.tree):
+            if (isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name)
+                    and stmt.targets[0].id in self.graph.nodes):
+                self.nodes[stmt.targets[0].id] = stmt.value
+            elif cluster_call(stmt) is not None:
+                self.clusters[cluster_id(stmt)] = (stmt, cluster_call(stmt))
+
+    def offset(self, lineno, col):
+        return self.line_starts[lineno - 1] + col
+
+    def segment(self, node):
+        return ast.get_source_segment(self.code, node)
+
+
+def _replace_spans(code, spans):
+    """Apply (start, end, text) replacements, which must not overlap"""
+    for start, end, text in sorted(spans, reverse=True):
+        code = code[:start] + text + code[end:]
+    return code
+
+
+class _CloudRemover:
+    def __init__(self, source, names, clusters):
+        self.source = source
+        self.names = set(names)
+        self.clusters = set(clusters)
+        self.spans = []
+
+    def _line_span(self, stmt):
+        """Offsets of the whole lines a statement occupies"""
+        lines = self.source.code.splitlines()
+        before = lines[stmt.lineno - 1][:stmt.col_offset]
+        after = lines[stmt.end_lineno - 1][stmt.end_col_offset:].strip()
+        if before.strip() or (after and not after.startswith("#")):
+            raise LocalEditError("Several statements share a line")
+        return self.source.line_starts[stmt.lineno - 1], self.source.line_starts[stmt.end_lineno]
+
+    def _expand_names(self):
+        """Removing a cluster removes its nodes; a list holding only removed nodes goes too"""
+        for stmt in ast.walk(self.source.tree):
+            if stmt in self.clusters:
+                for inner in ast.walk(stmt):
+                    if isinstance(inner, ast.Assign) and isinstance(inner.targets[0], ast.Name):
+                        self.names.add(inner.targets[0].id)
+                    elif isinstance(inner, ast.With) and inner.items[0].optional_vars is not None:
+                        self.names |= names_in(inner.items[0].optional_vars)
+        changed = True
+        while changed:
+            changed = False
+            for stmt in ast.walk(self.source.tree):
+                if (isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name)
+                        and isinstance(stmt.value, (ast.List, ast.Tuple)) and stmt.value.elts
+                        and all(isinstance(e, ast.Name) and e.id in self.names for e in stmt.value.elts)
+                        and stmt.targets[0].id not in self.names):
+                    self.names.add(stmt.targets[0].id)
+                    changed = True
+
+    def _operand_text(self, operand):
+        """Source of a chain operand without removed nodes; None if nothing is left"""
+        if isinstance(operand, ast.Name):
+            return None if operand.id in self.names else operand.id
+        if isinstance(operand, (ast.List, ast.Tuple)):
+            kept = []
+            for element in operand.elts:
+                if not isinstance(element, ast.Name) and names_in(element) & self.names:
+                    raise LocalEditError("Unsupported expression in a connection")
+                if not (isinstance(element, ast.Name) and element.id in self.names):
+                    kept.append(self.source.segment(element))
+            if not kept:
+                return None
+            if len(kept) == len(operand.elts):
+                return self.source.segment(operand)
+            return f"[{', '.join(kept)}]"
+        if names_in(operand) & self.names:
+            raise LocalEditError("Unsupported expression in a connection")
+        return self.source.segment(operand)
+
+    def _rewrite_chain(self, stmt):
+        operands, symbols = chain_parts(stmt.value)
+        # Split into node operands and the links (operators plus Edge(...) objects) between them
+        nodes, links, link = [], [], []
+        for index, operand in enumerate(operands):
+            if index:
+                link.append(symbols[index - 1])
+            if isinstance(operand, ast.Call) and call_name(operand) == "Edge":
+                if names_in(operand) & self.names:
+                    raise LocalEditError("Unsupported expression in a connection")
+                link.append(self.source.segment(operand))
+                continue
+            if nodes:
+                links.append(" ".join(link))
+            link = []
+            nodes.append(self._operand_text(operand))
+        runs, run = [], []
+        for index, text in enumerate(nodes):
+            if text is None:
+                runs.append(run)
+                run = []
+                continue
+            if run:
+                run.append(links[index - 1])
+            run.append(text)
+        runs.append(run)
+        kept = [" ".join(r) for r in runs if len(r) >= 3]
+        indent = " " * stmt.col_offset
+        return "".join(f"{indent}{line}\n" for line in kept)
+
+    def _visit(self, stmts):
+        """Plan edits for a block; returns True when every statement in it goes"""
+        removed = 0
+        for stmt in stmts:
+            if stmt in self.clusters:
+                self.spans.append((*self._line_span(stmt), ""))
+                removed += 1
+            elif isinstance(stmt, ast.Assign) and isinstance(stmt.targets[0], ast.Name) and stmt.targets[0].id in self.names:
+                self.spans.append((*self._line_span(stmt), ""))
+                removed += 1
+            elif isinstance(stmt, ast.Assign) and isinstance(stmt.value, (ast.List, ast.Tuple)) \
+                    and names_in(stmt.value) & self.names:
+                text = self._operand_text(stmt.value)
+                self.spans.append((self.source.offset(stmt.value.lineno, stmt.value.col_offset),
+                                   self.source.offset(stmt.value.end_lineno, stmt.value.end_col_offset), text))
+            elif isinstance(stmt, ast.Expr) and names_in(stmt.value) & self.names:
+                text = self._rewrite_chain(stmt)
+                self.spans.append((*self._line_span(stmt), text))
+                if not text:
+                    removed += 1
+            elif isinstance(stmt, ast.With):
+                if self._visit(stmt.body):
+                    if cluster_call(stmt) is None:
+                        raise LocalEditError("Edit would leave the diagram empty")
+                    # Drop the now empty cluster instead of the statements inside it
+                    start, end = self._line_span(stmt)
+                    self.spans = [s for s in self.spans if not (start <= s[0] < end)]
+                    self.spans.append((start, end, ""))
+                    removed += 1
+            elif names_in(stmt) & self.names:
+                raise LocalEditError("Removed component is used in an unsupported statement")
+        return removed == len(stmts)
+
+    def remove(self):
+        self._expand_names()
+        self._visit(self.source.tree.body)
+        return _drop_unused_imports(_replace_spans(self.source.code, self.spans))
+
+
+def _drop_unused_imports(code):
+    tree = ast.parse(code)
+    used = {n.id for n in ast.walk(tree) if isinstance(n, ast.Name)}
+    lines = code.splitlines(keepends=True)
+    for stmt in reversed(tree.body):
+        if (not isinstance(stmt, ast.ImportFrom) or not (stmt.module or "").startswith("diagrams.")
+                or stmt.lineno != stmt.end_lineno):
+            continue
+        kept = [a for a in stmt.names if (a.asname or a.name) in used]
+        if len(kept) == len(stmt.names):
+            continue
+        names = ", ".join(f"{a.name} as {a.asname}" if a.asname else a.name for a in kept)
+        lines[stmt.lineno - 1] = f"from {stmt.module} import {names}\n" if kept else ""
+    return "".join(lines)
+
+
+def _cloud_edit(code, operation):
+    source = _CloudSource(code)
+    graph = source.graph
+    if operation[0] == "remove":
+        names, clusters, done = set(), set(), []
+        for found in _resolve(graph, operation[1]):
+            for element_id in found:
+                if element_id in source.clusters:
+                    clusters.add(source.clusters[element_id][0])
+                else:
+                    names.add(element_id)
+                done.append(f"Removed {graph.label(element_id)}")
+        new_code = _CloudRemover(source, names, clusters).remove()
+        if names_in(ast.parse(new_code)) & names:
+            raise LocalEditError("Removed component is still referenced")
+        return new_code, done
+
+    _, target, new_label = operation
+    element_id = _resolve_one(graph, target)
+    call = source.clusters[element_id][1] if element_id in source.clusters else source.nodes[element_id]
+    constant = call_label(call)
+    if constant is None:
+        raise LocalEditError(f"'{target}' has no label to rename")
+    span = (source.offset(constant.lineno, constant.col_offset),
+            source.offset(constant.end_lineno, constant.end_col_offset), json.dumps(new_label))
+    return _replace_spans(code, [span]), [f"Renamed {graph.label(element_id)} to {new_label}"]
+
+
+# ----------------------------------------------------------------------------
+#  Mermaid flowcharts
+# ----------------------------------------------------------------------------
+
+def _split_runs(operands, arrows):
+    """Rejoin the kept operands (None = removed) of a chain into runs of connected operands"""
+    runs, run = [], []
+    for index, operand in enumerate(operands):
+        if operand is None:
+            runs.append(run)
+            run = []
+            continue
+        if run:
+            run.append(arrows[index - 1])
+        run.append(operand)
+    runs.append(run)
+    return runs
+
+
+def _mermaid_remove_line(line, names):
+    """(replacement text or None, survivors) for one line.
+
+    Survivors are (node id, declaration) pairs for nodes a broken connection
+    leaves on their own; the caller writes back those nothing else declares.
+    """
+    stripped = line.strip()
+    indent = line[:len(line) - len(line.lstrip())]
+    first = stripped.split(" ", 1)[0] if stripped else ""
+    if first in ("style", "click"):
+        parts = stripped.split()
+        return (None if len(parts) > 1 and parts[1] in names else line), []
+    if first == "class":
+        parts = stripped.split()
+        if len(parts) < 3:
+            return line, []
+        kept = [i for i in parts[1].split(",") if i not in names]
+        return (f"{indent}class {','.join(kept)} {' '.join(parts[2:])}" if kept else None), []
+    if not stripped or stripped.startswith("%%") or first in MERMAID_KEYWORDS:
+        return line, []
+
+    masked, labels = mask_labels(stripped)
+    pieces = MERMAID_ARROW.split(masked)
+    operands, arrows = pieces[0::2], pieces[1::2]
+    if not any(node_id in names for operand in operands for node_id in mermaid_operand_ids(operand)):
+        return line, []
+    kept_operands = []
+    for operand in operands:
+        parts = [p.strip() for p in operand.split("&")]
+        kept = [p for p in parts if mermaid_operand_ids(p)[0] not in names] if operand.strip() else []
+        kept_operands.append(" & ".join(kept) if kept else None)
+    runs = _split_runs(kept_operands, arrows)
+    kept_lines = [" ".join(r) for r in runs if len(r) >= 3]
+    survivors = [
+        (mermaid_operand_ids(part)[0], indent + unmask_labels(part.strip(), labels))
+        for r in runs if len(r) == 1 for part in r[0].split("&")
+    ]
+    text = "\n".join(indent + unmask_labels(t, labels) for t in kept_lines) if kept_lines else None
+    return text, survivors
+
+
+def _write_back(rewritten, parse):
+    """Join rewritten lines, adding survivors that would otherwise vanish.
+
+    rewritten holds (text or None, survivors) per line; a survivor is kept
+    when no other line declares its id or when it carries a label.
+    """
+    graph = parse("\n".join(text for text, _ in rewritten if text is not None))
+    present = set(graph.nodes) | set(graph.groups)
+    lines = []
+    for text, survivors in rewritten:
+        if text is not None:
+            lines.append(text)
+        for element_id, declaration in survivors:
+            if element_id not in present or declaration.strip() != element_id:
+                lines.append(declaration)
+                present.add(element_id)
+    return lines
+
+
+def _mermaid_edit(code, operation):
+    lines = code.splitlines()
+    header = next((l.strip() for l in lines if l.strip() and not l.strip().startswith("%%")), "")
+    if not re.match(r"(graph|flowchart)\b", header):
+        raise LocalEditError("Only flowcharts are edited locally")
+    if any(l.strip().startswith("linkStyle") for l in lines):
+        raise LocalEditError("linkStyle refers to edges by position")
+    graph = parse_mermaid(code)
+
+    if operation[0] == "remove":
+        names, done = set(), []
+        for found in _resolve(graph, operation[1]):
+            if any(element_id in graph.groups for element_id in found):
+                raise LocalEditError("Subgraphs are not removed locally")
+            names.update(found)
+            done.extend(f"Removed {graph.label(element_id)}" for element_id in found)
+        new_lines = _write_back([_mermaid_remove_line(line, names) for line in lines], parse_mermaid)
+        new_code = "\n".join(new_lines) + ("\n" if code.endswith("\n") else "")
+        if set(parse_mermaid(new_code).nodes) != set(graph.nodes) - names:
+            raise LocalEditError("Edit would remove or keep other nodes than requested")
+        return new_code, done
+
+    _, target, new_label = operation
+    node_id = _resolve_one(graph, target)
+    if node_id in graph.groups:
+        raise LocalEditError("Subgraphs are not renamed locally")
+    label = graph.label(node_id)
+    quoted = json.dumps(new_label)
+    pattern = re.compile(rf"(?<![\w]){re.escape(node_id)}\s*(\(\(|\[\[|\[\(|\(\[|\{{\{{|\[/|\[\\|\[|\(|\{{|>)(.*?)(\)\)|\]\]|\)\]|\]\)|\}}\}}|/\]|\\\]|\]|\)|\}})")
+    if pattern.search(code):
+        new_code = pattern.sub(lambda m: f"{node_id}{m.group(1)}{quoted}{m.group(3)}", code)
+    else:
+        # Bare id: give its first appearance a label
+        new_code = re.sub(rf"(?<![\w\x00]){re.escape(node_id)}(?![\w\[\(\{{])", f"{node_id}[{quoted}]", code, count=1)
+    return new_code, [f"Renamed {label or node_id} to {new_label}"]
+
+
+# ----------------------------------------------------------------------------
+#  D2
+# ----------------------------------------------------------------------------
+
+def _d2_refers(full, names):
+    return any(full == n or full.startswith(n + ".") for n in names)
+
+
+def _d2_rewrite_connection(line, stripped, container, names):
+    """(replacement lines, survivors) for a connection line, or None when it does not touch removed shapes"""
+    opens = stripped.endswith("{")
+    body = stripped[:-1].strip() if opens else stripped
+    key_part, colon, label = body.partition(":")
+    pieces = D2_ARROW.split(key_part)
+    operands, arrows = pieces[0::2], pieces[1::2]
+    gone = [_d2_refers(d2_full_path(container, o), names) for o in operands]
+    if not any(gone):
+        return None
+    runs = _split_runs([None if gone[i] else o.strip() for i, o in enumerate(operands)], arrows)
+    kept = [r for r in runs if len(r) >= 3]
+    if kept and opens:
+        raise LocalEditError("Connection with a style block would be split")
+    indent = line[:len(line) - len(line.lstrip())]
+    suffix = f":{label}" if colon else ""
+    survivors = [(d2_full_path(container, r[0]), f"{indent}{r[0]}") for r in runs if len(r) == 1]
+    return [f"{indent}{' '.join(r)}{suffix}" for r in kept], survivors
+
+
+def _d2_edit(code, operation):
+    lines = code.splitlines()
+    if any(";" in d2_strip(l) for l in lines):
+        raise LocalEditError("Semicolon-separated D2 is not edited locally")
+    graph = parse_d2(code)
+
+    if operation[0] == "rename":
+        _, target, new_label = operation
+        path = _resolve_one(graph, target)
+        label = graph.label(path)
+        quoted = json.dumps(new_label)
+        for index, stripped, container in d2_lines(lines):
+            match = re.match(rf"^({D2_KEY})\s*(?::\s*([^{{]*?))?\s*(\{{)?$", stripped)
+            if (match and container is not None and not D2_ARROW.search(stripped)
+                    and d2_full_path(container, match.group(1)) == path):
+                indent = lines[index][:len(lines[index]) - len(lines[index].lstrip())]
+                block = " {" if match.group(3) else ""
+                lines[index] = f"{indent}{match.group(1)}: {quoted}{block}"
+                break
+        else:
+            lines.append(f"{path}: {quoted}")
+        return "\n".join(lines) + ("\n" if code.endswith("\n") else ""), [f"Renamed {label} to {new_label}"]
+
+    names, done = set(), []
+    for found in _resolve(graph, operation[1]):
+        names.update(found)
+        done.extend(f"Removed {graph.label(path)}" for path in found)
+
+    output, dropping = [], []  # output: (text or None, survivors); dropping: one flag per open block
+    for index, stripped, container in d2_lines(lines):
+        line = lines[index]
+        if stripped == "}":
+            if not any(dropping):
+                output.append((line, []))
+            if dropping:
+                dropping.pop()
+            continue
+        opens = stripped.endswith("{")
+        if any(dropping):
+            if opens:
+                dropping.append(True)
+            continue
+        drop_block = False
+        if stripped and container is not None:
+            key_part = stripped.split(":", 1)[0]
+            if D2_ARROW.search(key_part):
+                replacement = _d2_rewrite_connection(line, stripped, container, names)
+                if replacement is not None:
+                    kept, survivors = replacement
+                    output.extend((text, []) for text in kept)
+                    output.append((None, survivors))
+                    drop_block = opens
+                    line = None
+            else:
+                match = re.match(D2_KEY, stripped)
+                if match and _d2_refers(d2_full_path(container, match.group(0)), names):
+                    drop_block = opens
+                    line = None
+        if line is not None:
+            output.append((line, []))
+        if opens:
+            dropping.append(drop_block)
+
+    new_code = "\n".join(_write_back(output, parse_d2)) + ("\n" if code.endswith("\n") else "")
+    remaining = parse_d2(new_code)
+    expected = {p for p in list(graph.nodes) + list(graph.groups) if not _d2_refers(p, names)}
+    if set(remaining.nodes) | set(remaining.groups) != expected:
+        raise LocalEditError("Edit would remove or keep other shapes than requested")
+    return new_code, done
+
+
+def apply_local_edit(diagram_type, code, request):
+    """Apply a simple remove/rename edit without the LLM.
+
+    Returns (new_code, modifications); raises LocalEditError when the request
+    is not a simple structural edit or cannot be resolved unambiguously.
+    """
+    operation = parse_edit_request(request)
+    if operation is None:
+        raise LocalEditError("Not a simple remove/rename request")
+    if not code:
+        raise LocalEditError("No current code")
+    editors = {"cloud": _cloud_edit, "mermaid": _mermaid_edit, "d2": _d2_edit}
+    if diagram_type not in editors:
+        raise LocalEditError(f"No local editor for {diagram_type}")
+    return editors[diagram_type](code, operation)
@@ -0,0 +1,223 @@
+import os
+import abc
+import json
+import shlex
+import base64
+import asyncio
+import weakref
+import contextvars
+import threading
+import subprocess
+
+# ============================================================================
+#                           MERMAID RENDERERS
+# ============================================================================
+# Two interchangeable backends behind MermaidRenderer.render(code, fmt):
+#   http  - pooled keep-alive client for a mermaid.ink compatible endpoint
+#   local - one long-lived renderer process fed many diagrams over stdin
+
+MERMAID_RENDERER = os.getenv("MERMAID_RENDERER", "http")
+MERMAID_ENDPOINT = os.getenv("MERMAID_ENDPOINT", "https://mermaid.ink")
+MERMAID_TIMEOUT = int(os.getenv("MERMAID_TIMEOUT", "30"))
+MERMAID_LOCAL_CMD = os.getenv(
+    "MERMAID_LOCAL_CMD",
+    f"node {os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mermaid_server.mjs')}"
+)
+
+
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+# Set by blocking entry points that run a throwaway event loop per call
+# (asyncio.run). Async renders under it go through the pooled requests
+# session in a thread, so connections are reused across calls instead of
+# living and dying with each loop.
+blocking_caller = contextvars.ContextVar("mermaid_blocking_caller", default=False)
+
+
+class MermaidRenderError(Exception):
+    """Raised when a backend cannot render a diagram"""
+
+
+class MermaidRenderer(abc.ABC):
+    """Renders Mermaid source to image bytes"""
+
+    name = "base"
+
+    @property
+    def version(self):
+        """Identifies the backend in render cache keys"""
+        return self.name
+
+    @abc.abstractmethod
+    def render(self, code, fmt="png"):
+        """Image bytes for code in fmt ("png" or "svg"); raises MermaidRenderError"""
+
+    async def a_render(self, code, fmt="png"):
+        """Async render; backends without native async I/O run render() in a thread"""
+        return await asyncio.to_thread(self.render, code, fmt)
+
+    def close(self):
+        pass
+
+
+class HttpMermaidRenderer(MermaidRenderer):
+    """mermaid.ink style HTTP API (public, self-hosted or a local stand-in) over a pooled session"""
+
+    name = "http"
+
+    def __init__(self, endpoint=MERMAID_ENDPOINT, timeout=MERMAID_TIMEOUT, retries=3, pool_size=8, backoff=0.5):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.endpoint = endpoint.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.pool_size = pool_size
+        self.backoff = backoff
+        self.async_clients = weakref.WeakKeyDictionary()  # event loop -> (httpx.AsyncClient, its closer)
+        self.session = requests.Session()
+        # Hand back the last response once retries run out, so both paths report its status
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+                      allowed_methods=["GET"], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def version(self):
+        return f"http:{self.endpoint}"
+
+    def url(self, code, fmt="png"):
+        encoded = base64.urlsafe_b64encode(code.encode("utf-8")).decode("utf-8")
+        if fmt == "svg":
+            return f"{self.endpoint}/svg/{encoded}"
+        return f"{self.endpoint}/img/{encoded}?type={fmt}"
+
+    def render(self, code, fmt="png"):
+        response = self.session.get(self.url(code, fmt), timeout=self.timeout)
+        if response.status_code != 200:
+            raise MermaidRenderError(f"Web service status {response.status_code}")
+        return response.content
+
+    @staticmethod
+    async def _close_with_loop(client):
+        try:
+            yield
+        finally:
+            await client.aclose()
+
+    async def _async_client(self):
+        # httpx connections belong to the loop that opened them, so keep one client per loop.
+        # An async generator guards each client: loops close those when they shut down
+        # (asyncio.run calls loop.shutdown_asyncgens), which closes the client with it.
+        loop = asyncio.get_running_loop()
+        entry = self.async_clients.get(loop)
+        if entry is None:
+            import httpx
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            client = httpx.AsyncClient(timeout=self.timeout, limits=limits)
+            entry = self.async_clients[loop] = (client, self._close_with_loop(client))
+            await entry[1].__anext__()  # runs straight to the yield
+        return entry[0]
+
+    async def a_render(self, code, fmt="png"):
+        if blocking_caller.get():
+            return await super().a_render(code, fmt)
+        client = await self._async_client()
+        for attempt in range(self.retries + 1):
+            response = await client.get(self.url(code, fmt))
+            if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                break
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+        if response.status_code != 200:
+            raise MermaidRenderError(f"Web service status {response.status_code}")
+        return response.content
+
+    def close(self):
+        self.session.close()
+
+
+class LocalMermaidRenderer(MermaidRenderer):
+    """Long-lived local renderer process speaking JSON lines on stdin/stdout.
+
+    Request:  {"code": "...", "format": "png"}
+    Response: {"ok": true, "data": "<base64>"} or {"ok": false, "error": "..."}
+    """
+
+    name = "local"
+
+    def __init__(self, command=MERMAID_LOCAL_CMD, timeout=MERMAID_TIMEOUT):
+        self.command = shlex.split(command)
+        self.timeout = timeout
+        self.process = None
+        self.lock = threading.Lock()
+
+    @property
+    def version(self):
+        return f"local:{' '.join(self.command)}"
+
+    def _ensure_process(self):
+        if self.process is None or self.process.poll() is not None:
+            self.close()
+            self.process = subprocess.Popen(
+                self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, text=True, bufsize=1
+            )
+        return self.process
+
+    def render(self, code, fmt="png"):
+        # One diagram at a time per process; the process itself stays up between diagrams
+        with self.lock:
+            process = self._ensure_process()
+            try:
+                process.stdin.write(json.dumps({"code": code, "format": fmt}) + "\n")
+                process.stdin.flush()
+                timer = threading.Timer(self.timeout, process.kill)
+                timer.start()
+                try:
+                    line = process.stdout.readline()
+                finally:
+                    timer.cancel()
+            except (BrokenPipeError, OSError) as e:
+                self.close()
+                raise MermaidRenderError(f"Local renderer crashed: {e}")
+            if not line:
+                self.close()
+                raise MermaidRenderError("Local renderer exited or timed out")
+        reply = json.loads(line)
+        if not reply.get("ok"):
+            raise MermaidRenderError(reply.get("error", "Local renderer failed"))
+        return base64.b64decode(reply["data"])
+
+    def close(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+            for pipe in (self.process.stdin, self.process.stdout):
+                try:
+                    pipe.close()
+                except OSError:  # unflushed input to a dead process
+                    pass
+            self.process = None
+
+
+RENDERERS = {
+    "http": HttpMermaidRenderer,
+    "local": LocalMermaidRenderer,
+}
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_mermaid_renderer():
+    """Shared renderer for the backend selected by MERMAID_RENDERER"""
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            if MERMAID_RENDERER not in RENDERERS:
+                raise MermaidRenderError(f"Unknown MERMAID_RENDERER '{MERMAID_RENDERER}'")
+            _renderer = RENDERERS[MERMAID_RENDERER]()
+        return _renderer
@@ -0,0 +1,26 @@
+// Long-lived Mermaid renderer for MERMAID_RENDERER=local.
+// Keeps one headless browser open and renders one diagram per stdin line:
+//   in:  {"code": "graph TD; A-->B", "format": "png"}
+//   out: {"ok": true, "data": "<base64>"}  or  {"ok": false, "error": "..."}
+//
+// npm install @mermaid-js/mermaid-cli puppeteer
+import readline from "node:readline";
+import puppeteer from "puppeteer";
+import { renderMermaid } from "@mermaid-js/mermaid-cli";
+
+const browser = await puppeteer.launch({ headless: "new" });
+const lines = readline.createInterface({ input: process.stdin });
+
+for await (const line of lines) {
+  let reply;
+  try {
+    const { code, format = "png" } = JSON.parse(line);
+    const { data } = await renderMermaid(browser, code, format, { backgroundColor: "white" });
+    reply = { ok: true, data: Buffer.from(data).toString("base64") };
+  } catch (err) {
+    reply = { ok: false, error: String((err && err.message) || err) };
+  }
+  process.stdout.write(JSON.stringify(reply) + "\n");
+}
+
+await browser.close();
@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+
+# ============================================================================
+#                           SESSION STORES
+# ============================================================================
+# Where DiagramMemory keeps its state. The SQLite store (WAL mode) is the
+# default: one row per session plus one row per history step, so an iteration
+# appends a step instead of rewriting the whole document, and every save is a
+# single transaction. The JSON store keeps the original memory/<id>.json files.
+#
+# Every store has load/exists/save/delete plus stamp(): a cheap token (last
+# write time) that changes whenever a session is saved, so callers holding a
+# session in memory can tell that another process has written it since.
+
+
+class JsonSessionStore:
+    """Legacy store: one indented JSON document per session, rewritten on every save"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id):
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    def exists(self, session_id):
+        return os.path.exists(self._path(session_id))
+
+    def stamp(self, session_id):
+        try:
+            return os.stat(self._path(session_id)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load(self, session_id):
+        """Session state, or None if the session does not exist"""
+        try:
+            with open(self._path(session_id), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state):
+        path = self._path(state["session_id"])
+        # Write then rename, so a crash never leaves a half-written session behind
+        temp = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(temp, path)
+        return self.stamp(state["session_id"])
+
+    def delete(self, session_id):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+
+class SqliteSessionStore:
+    """Sessions in SQLite: indexed by id and last update, history stored as appended rows.
+
+    Sessions missing here are looked up in `legacy` (a JsonSessionStore) and
+    imported on first load, so existing memory/*.json sessions keep working.
+    """
+
+    def __init__(self, path, legacy=None):
+        self.path = path
+        self.legacy = legacy
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _db(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # The timeout lets replicas sharing the file wait out each other's writes
+            self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                "session_id TEXT NOT NULL, step INTEGER NOT NULL, entry TEXT NOT NULL, "
+                "PRIMARY KEY (session_id, step))"
+            )
+        return self.conn
+
+    def exists(self, session_id):
+        with self.lock:
+            row = self._db().execute(
+                "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row is not None or bool(self.legacy and self.legacy.exists(session_id))
+
+    def stamp(self, session_id):
+        with self.lock:
+            row = self._db().execute(
+                "SELECT updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def load(self, session_id):
+        """Session state, or None if the session does not exist"""
+        with self.lock:
+            db = self._db()
+            row = db.execute("SELECT state FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is not None:
+                state = json.loads(row[0])
+                state["history"] = [
+                    json.loads(entry) for (entry,) in db.execute(
+                        "SELECT entry FROM history WHERE session_id = ? ORDER BY step", (session_id,)
+                    )
+                ]
+                return state
+        state = self.legacy.load(session_id) if self.legacy else None
+        if state is not None:
+            self.save(state)
+        return state
+
+    def save(self, state):
+        """Upsert the session row, append new history steps and drop steps folded out of it"""
+        history = state.get("history", [])
+        header = {key: value for key, value in state.items() if key != "history"}
+        updated_at = time.time()
+        with self.lock:
+            db = self._db()
+            with db:  # one transaction
+                db.execute(
+                    "INSERT INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (session_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                    (state["session_id"], json.dumps(header), updated_at)
+                )
+                rows = {entry["step"]: json.dumps(entry) for entry in history}
+                if not rows:
+                    db.execute("DELETE FROM history WHERE session_id = ?", (state["session_id"],))
+                    return updated_at
+                first = min(rows)
+                stored = dict(db.execute(
+                    "SELECT step, entry FROM history WHERE session_id = ? AND step >= ?", (state["session_id"], first)
+                ))
+                if any(rows.get(step) != entry for step, entry in stored.items()):
+                    # History was rewound or branched: rewrite the part that differs
+                    db.execute(
+                        "DELETE FROM history WHERE session_id = ? AND step >= ?", (state["session_id"], first)
+                    )
+                    stored = {}
+                db.executemany(
+                    "INSERT INTO history (session_id, step, entry) VALUES (?, ?, ?)",
+                    [(state["session_id"], step, entry) for step, entry in rows.items() if step not in stored]
+                )
+                db.execute("DELETE FROM history WHERE session_id = ? AND step < ?", (state["session_id"], first))
+        return updated_at
+
+    def delete(self, session_id):
+        with self.lock:
+            db = self._db()
+            with db:
+                db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                db.execute("DELETE FROM history WHERE session_id = ?", (session_id,))
+        if self.legacy:
+            self.legacy.delete(session_id)
+
+
+class WriteBehindStore:
+    """Wraps a store so saves are written by a background thread.
+
+    Repeated saves of a session coalesce into one write of its latest state.
+    flush(session_id) waits until a session is on disk (and re-raises a failed
+    write); everything still pending is flushed at interpreter exit.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.pending = {}  # session_id -> latest unwritten state
+        self.written = {}  # session_id -> stamp of its last write, or the exception it raised
+        self.writing = None
+        self.cond = threading.Condition()
+        self.thread = None
+        atexit.register(self.flush_all)
+
+    def _writer(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                session_id, state = next(iter(self.pending.items()))
+                self.writing = session_id
+            try:
+                result = self.inner.save(state)
+            except Exception as e:
+                result = e
+            with self.cond:
+                # A newer save may have replaced the state while it was being written
+                if self.pending.get(session_id) is state:
+                    del self.pending[session_id]
+                self.written[session_id] = result
+                self.writing = None
+                self.cond.notify_all()
+
+    def save(self, state):
+        with self.cond:
+            # Re-queue at the back so one busy session cannot starve the others
+            self.pending.pop(state["session_id"], None)
+            self.pending[state["session_id"]] = state
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._writer, name="session-writer", daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+
+    def flush(self, session_id):
+        """Wait for a session's pending save; returns its stamp (None if nothing was pending)"""
+        with self.cond:
+            while session_id in self.pending:
+                self.cond.wait()
+            result = self.written.pop(session_id, None)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def flush_all(self):
+        with self.cond:
+            while self.pending:
+                self.cond.wait()
+            self.written.clear()
+
+    def is_pending(self, session_id):
+        with self.cond:
+            return session_id in self.pending
+
+    def load(self, session_id):
+        with self.cond:
+            state = self.pending.get(session_id)
+        if state is not None:
+            return json.loads(json.dumps(state))
+        return self.inner.load(session_id)
+
+    def exists(self, session_id):
+        return self.is_pending(session_id) or self.inner.exists(session_id)
+
+    def stamp(self, session_id):
+        return self.inner.stamp(session_id)
+
+    def delete(self, session_id):
+        with self.cond:
+            self.pending.pop(session_id, None)
+            while self.writing == session_id:
+                self.cond.wait()
+            self.written.pop(session_id, None)
+        self.inner.delete(session_id)
+
+
+def open_session_store(backend, db_path, directory):
+    """Session store for SESSION_STORE: "sqlite" (default) or "json" (legacy files)"""
+    legacy = JsonSessionStore(directory)
+    if backend == "json":
+        return legacy
+    if backend != "sqlite":
+        raise ValueError(f"Unknown session store: {backend}")
+    return SqliteSessionStore(db_path, legacy=legacy)
@@ -0,0 +1,525 @@
+import ast
+import re
+from collections import defaultdict
+
+# ============================================================================
+#                           TERRAFORM TO DIAGRAMS
+# ============================================================================
+# Turns a Terraform file straight into a `diagrams` script: a small HCL parser,
+# a resource type -> node class table, clusters per service category and edges
+# from the references between resources. Only resource types missing from the
+# table need the LLM, and only to name a node class for them.
+
+
+class TerraformError(Exception):
+    """Raised when a file cannot be parsed or turned into a diagram locally"""
+
+
+# Resource type -> "<provider>.<category>.<Class>" under the diagrams package
+RESOURCE_NODES = {
+    # AWS
+    "aws_instance": "aws.compute.EC2",
+    "aws_launch_template": "aws.compute.EC2",
+    "aws_autoscaling_group": "aws.compute.AutoScaling",
+    "aws_lambda_function": "aws.compute.Lambda",
+    "aws_ecs_cluster": "aws.compute.ECS",
+    "aws_ecs_service": "aws.compute.ElasticContainerServiceService",
+    "aws_eks_cluster": "aws.compute.EKS",
+    "aws_eks_node_group": "aws.compute.EC2",
+    "aws_ecr_repository": "aws.compute.ECR",
+    "aws_elastic_beanstalk_environment": "aws.compute.ElasticBeanstalk",
+    "aws_batch_compute_environment": "aws.compute.Batch",
+    "aws_db_instance": "aws.database.RDS",
+    "aws_rds_cluster": "aws.database.Aurora",
+    "aws_rds_cluster_instance": "aws.database.AuroraInstance",
+    "aws_dynamodb_table": "aws.database.Dynamodb",
+    "aws_elasticache_cluster": "aws.database.ElastiCache",
+    "aws_elasticache_replication_group": "aws.database.ElastiCache",
+    "aws_redshift_cluster": "aws.database.Redshift",
+    "aws_docdb_cluster": "aws.database.DocumentDB",
+    "aws_neptune_cluster": "aws.database.Neptune",
+    "aws_s3_bucket": "aws.storage.S3",
+    "aws_efs_file_system": "aws.storage.EFS",
+    "aws_ebs_volume": "aws.storage.EBS",
+    "aws_fsx_lustre_file_system": "aws.storage.Fsx",
+    "aws_backup_vault": "aws.storage.Backup",
+    "aws_vpc": "aws.network.VPC",
+    "aws_lb": "aws.network.ALB",
+    "aws_alb": "aws.network.ALB",
+    "aws_elb": "aws.network.ELB",
+    "aws_nat_gateway": "aws.network.NATGateway",
+    "aws_internet_gateway": "aws.network.InternetGateway",
+    "aws_route53_zone": "aws.network.Route53",
+    "aws_route53_record": "aws.network.Route53",
+    "aws_cloudfront_distribution": "aws.network.CloudFront",
+    "aws_api_gateway_rest_api": "aws.network.APIGateway",
+    "aws_apigatewayv2_api": "aws.network.APIGateway",
+    "aws_vpc_endpoint": "aws.network.Endpoint",
+    "aws_ec2_transit_gateway": "aws.network.TransitGateway",
+    "aws_sqs_queue": "aws.integration.SQS",
+    "aws_sns_topic": "aws.integration.SNS",
+    "aws_sfn_state_machine": "aws.integration.StepFunctions",
+    "aws_cloudwatch_event_rule": "aws.integration.Eventbridge",
+    "aws_mq_broker": "aws.integration.MQ",
+    "aws_kinesis_stream": "aws.analytics.KinesisDataStreams",
+    "aws_kinesis_firehose_delivery_stream": "aws.analytics.KinesisDataFirehose",
+    "aws_glue_job": "aws.analytics.Glue",
+    "aws_athena_workgroup": "aws.analytics.Athena",
+    "aws_emr_cluster": "aws.analytics.EMR",
+    "aws_msk_cluster": "aws.analytics.ManagedStreamingForKafka",
+    "aws_opensearch_domain": "aws.analytics.AmazonOpensearchService",
+    "aws_elasticsearch_domain": "aws.analytics.ElasticsearchService",
+    "aws_cloudwatch_log_group": "aws.management.Cloudwatch",
+    "aws_cloudwatch_metric_alarm": "aws.management.CloudwatchAlarm",
+    "aws_cloudtrail": "aws.management.Cloudtrail",
+    "aws_cognito_user_pool": "aws.security.Cognito",
+    "aws_kms_key": "aws.security.KMS",
+    "aws_secretsmanager_secret": "aws.security.SecretsManager",
+    "aws_wafv2_web_acl": "aws.security.WAF",
+    "aws_iam_role": "aws.security.IAMRole",
+    "aws_acm_certificate": "aws.security.CertificateManager",
+    "aws_sagemaker_endpoint": "aws.ml.Sagemaker",
+    # GCP
+    "google_compute_instance": "gcp.compute.ComputeEngine",
+    "google_compute_instance_template": "gcp.compute.ComputeEngine",
+    "google_compute_instance_group_manager": "gcp.compute.ComputeEngine",
+    "google_cloudfunctions_function": "gcp.compute.Functions",
+    "google_cloudfunctions2_function": "gcp.compute.Functions",
+    "google_cloud_run_service": "gcp.compute.Run",
+    "google_cloud_run_v2_service": "gcp.compute.Run",
+    "google_container_cluster": "gcp.compute.GKE",
+    "google_container_node_pool": "gcp.compute.GKE",
+    "google_app_engine_application": "gcp.compute.AppEngine",
+    "google_sql_database_instance": "gcp.database.SQL",
+    "google_spanner_instance": "gcp.database.Spanner",
+    "google_bigtable_instance": "gcp.database.Bigtable",
+    "google_firestore_database": "gcp.database.Firestore",
+    "google_redis_instance": "gcp.database.Memorystore",
+    "google_storage_bucket": "gcp.storage.GCS",
+    "google_filestore_instance": "gcp.storage.Filestore",
+    "google_compute_network": "gcp.network.VPC",
+    "google_compute_subnetwork": "gcp.network.VPC",
+    "google_compute_router": "gcp.network.Router",
+    "google_compute_router_nat": "gcp.network.NAT",
+    "google_compute_global_forwarding_rule": "gcp.network.LoadBalancing",
+    "google_compute_forwarding_rule": "gcp.network.LoadBalancing",
+    "google_compute_url_map": "gcp.network.LoadBalancing",
+    "google_compute_backend_service": "gcp.network.LoadBalancing",
+    "google_dns_managed_zone": "gcp.network.DNS",
+    "google_compute_firewall": "gcp.network.FirewallRules",
+    "google_pubsub_topic": "gcp.analytics.PubSub",
+    "google_pubsub_subscription": "gcp.analytics.PubSub",
+    "google_bigquery_dataset": "gcp.analytics.BigQuery",
+    "google_dataflow_job": "gcp.analytics.Dataflow",
+    "google_kms_crypto_key": "gcp.security.KMS",
+    "google_secret_manager_secret": "gcp.security.SecretManager",
+    "google_service_account": "gcp.security.Iam",
+    # Azure
+    "azurerm_linux_virtual_machine": "azure.compute.VM",
+    "azurerm_windows_virtual_machine": "azure.compute.VM",
+    "azurerm_virtual_machine": "azure.compute.VM",
+    "azurerm_kubernetes_cluster": "azure.compute.AKS",
+    "azurerm_function_app": "azure.compute.FunctionApps",
+    "azurerm_linux_function_app": "azure.compute.FunctionApps",
+    "azurerm_app_service": "azure.compute.AppServices",
+    "azurerm_linux_web_app": "azure.compute.AppServices",
+    "azurerm_container_registry": "azure.compute.ContainerRegistries",
+    "azurerm_mssql_server": "azure.database.SQLServers",
+    "azurerm_mssql_database": "azure.database.SQLDatabases",
+    "azurerm_postgresql_flexible_server": "azure.database.DatabaseForPostgresqlServers",
+    "azurerm_mysql_flexible_server": "azure.database.DatabaseForMysqlServers",
+    "azurerm_cosmosdb_account": "azure.database.CosmosDb",
+    "azurerm_redis_cache": "azure.database.CacheForRedis",
+    "azurerm_storage_account": "azure.storage.StorageAccounts",
+    "azurerm_virtual_network": "azure.network.VirtualNetworks",
+    "azurerm_subnet": "azure.network.Subnets",
+    "azurerm_lb": "azure.network.LoadBalancers",
+    "azurerm_application_gateway": "azure.network.ApplicationGateway",
+    "azurerm_public_ip": "azure.network.PublicIpAddresses",
+    "azurerm_dns_zone": "azure.network.DNSZones",
+    "azurerm_key_vault": "azure.security.KeyVaults",
+    "azurerm_servicebus_namespace": "azure.integration.ServiceBus",
+    "azurerm_eventhub_namespace": "azure.analytics.EventHubs",
+    "azurerm_log_analytics_workspace": "azure.analytics.LogAnalyticsWorkspaces",
+}
+MODULE_NODE = "onprem.iac.Terraform"
+
+# Resource types whose node class depends on an attribute: (attribute, {literal value: node class})
+RESOURCE_VARIANTS = {
+    "aws_lb": ("load_balancer_type", {"network": "aws.network.NLB", "gateway": "aws.network.ELB"}),
+    "aws_alb": ("load_balancer_type", {"network": "aws.network.NLB", "gateway": "aws.network.ELB"}),
+}
+
+# Edges found only through connecting plumbing point from the lower rank to the higher
+FLOW_RANK = {"network": 0, "compute": 1}
+
+# Plumbing that is not drawn; references through it still become edges
+IGNORED_RESOURCES = {
+    "aws_subnet", "aws_security_group", "aws_route_table", "aws_route", "aws_eip", "aws_key_pair",
+    "aws_iam_policy", "aws_iam_instance_profile", "aws_db_subnet_group", "aws_elasticache_subnet_group",
+    "aws_lb_listener", "aws_lb_target_group", "aws_lb_listener_rule", "aws_network_interface",
+    "google_project_service", "google_compute_address", "google_compute_global_address",
+    "azurerm_resource_group", "azurerm_network_interface", "azurerm_network_security_group",
+}
+IGNORED_PATTERN = re.compile(
+    r"^(random|null|time|tls|local|template|terraform|external)_"
+    r"|_(policy|policy_attachment|attachment|association|rule|member|binding|permission"
+    r"|version|versioning|acl|public_access_block|ownership_controls|notification"
+    r"|server_side_encryption_configuration|lifecycle_configuration)$"
+)
+NAME_ATTRIBUTES = ("name", "bucket", "cluster_identifier", "identifier", "function_name", "domain_name")
+
+
+# ---------------------------------------------------------------------- HCL
+
+def _strip_comments(text):
+    """Blank out #, // and /* */ comments (outside strings), keeping line breaks"""
+    out, i, n = [], 0, len(text)
+    in_string = False
+    while i < n:
+        c = text[i]
+        if in_string:
+            out.append(c)
+            if c == "\\" and i + 1 < n:
+                out.append(text[i + 1])
+                i += 1
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+            out.append(c)
+        elif c == "#" or text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end < 0 else end
+            continue
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            end = n if end < 0 else end + 2
+            out.append("\n" * text.count("\n", i, end))
+            i = end
+            continue
+        else:
+            out.append(c)
+        i += 1
+    return "".join(out)
+
+
+class _HclParser:
+    """Recursive-descent parser for the block/attribute structure of HCL.
+
+    Attribute values are kept as raw expression text: all the diagram needs
+    from them is literal names and references to other resources.
+    """
+
+    IDENT = re.compile(r"[A-Za-z_][\w\-]*")
+    HEREDOC = re.compile(r"<<-?([A-Za-z_]\w*)[ \t]*\n")
+
+    def __init__(self, text):
+        self.text = _strip_comments(text)
+        self.pos = 0
+
+    def error(self, message):
+        line = self.text.count("\n", 0, self.pos) + 1
+        raise TerraformError(f"HCL parse error on line {line}: {message}")
+
+    def skip_space(self, newlines=True):
+        chars = " \t\r\n" if newlines else " \t\r"
+        while self.pos < len(self.text) and self.text[self.pos] in chars:
+            self.pos += 1
+
+    def parse(self):
+        body = self.body()
+        if self.pos < len(self.text):
+            self.error("unexpected '}'")
+        return body
+
+    def body(self):
+        """Attributes and blocks up to a closing brace or the end of the text"""
+        attrs, blocks = {}, []
+        while True:
+            self.skip_space()
+            if self.pos >= len(self.text) or self.text[self.pos] == "}":
+                return {"attrs": attrs, "blocks": blocks}
+            match = self.IDENT.match(self.text, self.pos)
+            if not match:
+                self.error(f"unexpected {self.text[self.pos]!r}")
+            name = match.group(0)
+            self.pos = match.end()
+            self.skip_space(newlines=False)
+            if self.text.startswith("=", self.pos) and not self.text.startswith("==", self.pos):
+                self.pos += 1
+                attrs[name] = self.expression()
+                continue
+            labels = []
+            while self.pos < len(self.text) and self.text[self.pos] != "{":
+                if self.text[self.pos] == '"':
+                    labels.append(self.string())
+                else:
+                    label = self.IDENT.match(self.text, self.pos)
+                    if not label:
+                        self.error(f"expected a block label or '{{' after {name!r}")
+                    labels.append(label.group(0))
+                    self.pos = label.end()
+                self.skip_space(newlines=False)
+            if self.pos >= len(self.text):
+                self.error(f"block {name!r} is never opened")
+            self.pos += 1
+            inner = self.body()
+            if self.pos >= len(self.text):
+                self.error(f"block {name!r} is never closed")
+            self.pos += 1
+            blocks.append({"type": name, "labels": labels, **inner})
+
+    def string(self):
+        """A quoted string at pos; returns its raw content"""
+        start = self.pos + 1
+        self.pos = start
+        while self.pos < len(self.text):
+            c = self.text[self.pos]
+            if c == "\\":
+                self.pos += 2
+                continue
+            if c == '"':
+                self.pos += 1
+                return self.text[start:self.pos - 1]
+            if c == "\n":
+                break
+            if self.text.startswith(("${", "%{"), self.pos):
+                self.interpolation()
+                continue
+            self.pos += 1
+        self.error("unterminated string")
+
+    def interpolation(self):
+        """Skip a ${...} inside a string; it may contain strings of its own"""
+        self.pos += 2
+        depth = 1
+        while self.pos < len(self.text):
+            c = self.text[self.pos]
+            if c == '"':
+                self.string()
+                continue
+            if c == "{":
+                depth += 1
+            elif c == "}":
+                depth -= 1
+                if depth == 0:
+                    self.pos += 1
+                    return
+            self.pos += 1
+        self.error("unterminated interpolation")
+
+    def expression(self):
+        """Raw text of an attribute value: up to the end of line outside brackets"""
+        start, depth = self.pos, 0
+        while self.pos < len(self.text):
+            c = self.text[self.pos]
+            if c == '"':
+                self.string()
+                continue
+            heredoc = self.HEREDOC.match(self.text, self.pos)
+            if heredoc:
+                end = re.compile(rf"^[ \t]*{heredoc.group(1)}[ \t]*$", re.MULTILINE).search(self.text, heredoc.end())
+                if not end:
+                    self.error(f"heredoc {heredoc.group(1)} is never closed")
+                self.pos = end.end()
+                continue
+            if c in "([{":
+                depth += 1
+            elif c in ")]}":
+                if depth == 0:
+                    break  # closing brace of a one-line block
+                depth -= 1
+            elif c == "\n" and depth == 0:
+                break
+            self.pos += 1
+        if depth:
+            self.error("unbalanced brackets")
+        return self.text[start:self.pos].strip()
+
+
+def parse_hcl(text):
+    """HCL text -> {"attrs": {name: expression text}, "blocks": [{"type", "labels", "attrs", "blocks"}]}"""
+    return _HclParser(text).parse()
+
+
+# -------------------------------------------------------------------- graph
+
+def _expressions(block):
+    """Every attribute expression in a block, nested blocks included"""
+    for value in block["attrs"].values():
+        yield value
+    for inner in block["blocks"]:
+        yield from _expressions(inner)
+
+
+def _literal(expression):
+    match = re.fullmatch(r'"([^"$]*)"', expression or "")
+    return match.group(1) if match else None
+
+
+def _identifier(text, taken):
+    name = re.sub(r"\W", "_", text).strip("_").lower() or "node"
+    if name[0].isdigit() or name in {"diagram", "cluster", "edge"}:
+        name = f"n_{name}"
+    candidate, index = name, 2
+    while candidate in taken:
+        candidate, index = f"{name}_{index}", index + 1
+    taken.add(candidate)
+    return candidate
+
+
+def terraform_graph(text, extra_nodes=None):
+    """Resources of a Terraform file as nodes and reference edges.
+
+    Returns (nodes, edges, unmapped): nodes maps "type.name" (or "module.name")
+    to {"node": node class path, "label"}, edges are (from, to) pairs meaning
+    "from references to" (or, when joined only by connectors such as listeners
+    and attachments, "from sends to"), and unmapped lists resource types with
+    no node class.
+    """
+    table = dict(RESOURCE_NODES, **(extra_nodes or {}))
+    resources = {}  # address -> block
+    for block in parse_hcl(text)["blocks"]:
+        if block["type"] == "resource" and len(block["labels"]) == 2:
+            resources[".".join(block["labels"])] = block
+        elif block["type"] == "module" and len(block["labels"]) == 1:
+            resources[f"module.{block['labels'][0]}"] = block
+    if not resources:
+        raise TerraformError("No resources or modules to draw")
+
+    nodes, unmapped, hidden = {}, set(), set()
+    for address, block in resources.items():
+        kind, name = address.split(".", 1)
+        if kind == "module":
+            node = MODULE_NODE
+        elif kind in table:
+            node = table[kind]
+            if kind in RESOURCE_VARIANTS:
+                attribute, variants = RESOURCE_VARIANTS[kind]
+                node = variants.get(_literal(block["attrs"].get(attribute)), node)
+        else:
+            if kind not in IGNORED_RESOURCES and not IGNORED_PATTERN.search(kind):
+                unmapped.add(kind)
+            hidden.add(address)
+            continue
+        label = next((_literal(block["attrs"].get(attr)) for attr in NAME_ATTRIBUTES
+                      if _literal(block["attrs"].get(attr))), name)
+        count = block["attrs"].get("count", "")
+        if count.isdigit() and int(count) > 1:
+            label += f" (x{count})"
+        nodes[address] = {"node": node, "label": label}
+
+    reference = re.compile(
+        r"(?<![\w.])(" + "|".join(re.escape(address) for address in sorted(resources, key=len, reverse=True)) + r")(?![\w\-])"
+    )
+    refers = {
+        address: {match.group(1) for value in _expressions(block) for match in reference.finditer(value)} - {address}
+        for address, block in resources.items()
+    }
+
+    def reached(start):
+        """Drawn resources that start references, following references through hidden ones"""
+        found, seen, pending = set(), set(), list(refers[start])
+        while pending:
+            target = pending.pop()
+            if target in seen:
+                continue
+            seen.add(target)
+            if target in hidden:
+                pending.extend(refers[target])
+            elif target != start:
+                found.add(target)
+        return found, seen
+
+    edges, plumbing = set(), set()
+    for address in nodes:
+        # Through plumbing a drawn resource depends on (e.g. instance -> subnet -> vpc)
+        found, seen = reached(address)
+        edges.update((address, target) for target in found)
+        plumbing |= seen & hidden
+
+    # Hidden resources no drawn one depends on only tie others together, possibly
+    # through each other (lb <- listener -> target group <- attachment -> instance):
+    # each connected group of them links every drawn resource it reaches
+    connectors = hidden - plumbing
+    order = {address: index for index, address in enumerate(resources)}
+
+    def rank(address):
+        category = nodes[address]["node"].split(".")[1]
+        return FLOW_RANK.get(category, len(FLOW_RANK)), order[address]
+
+    grouped = set()
+    for start in sorted(connectors, key=order.get):
+        if start in grouped:
+            continue
+        group, pending = set(), [start]
+        while pending:
+            member = pending.pop()
+            if member in group:
+                continue
+            group.add(member)
+            pending.extend(other for other in connectors if other in refers[member] or member in refers[other])
+        grouped |= group
+        endpoints = sorted(set().union(*(reached(member)[0] for member in group)), key=rank)
+        for index, source in enumerate(endpoints):
+            for target in endpoints[index + 1:]:
+                if (target, source) not in edges:
+                    edges.add((source, target))
+    return nodes, sorted(edges), sorted(unmapped)
+
+
+def build_diagram_script(title, nodes, edges, unique_name):
+    """`diagrams` script for a terraform_graph(): one cluster per service category"""
+    imports = defaultdict(set)
+    groups = defaultdict(list)
+    for address, info in nodes.items():
+        module, cls = info["node"].rsplit(".", 1)
+        imports[module].add(cls)
+        provider, category = module.split(".", 1)
+        groups[(provider, category)].append(address)
+
+    taken = set()
+    variables = {address: _identifier(address.split(".", 1)[1], taken) for address in nodes}
+    lines = ["from diagrams import Diagram, Cluster"]
+    lines += [f"from diagrams.{module} import {', '.join(sorted(classes))}" for module, classes in sorted(imports.items())]
+    lines += ["", f'with Diagram({title!r}, filename="output/{unique_name}", outformat="dot", show=False):']
+
+    clustered = len(groups) > 1
+    providers = {provider for provider, _ in groups if provider != "onprem"}
+    for (provider, category), addresses in sorted(groups.items()):
+        indent = "    "
+        if clustered:
+            heading = category.replace("_", " ").title()
+            if provider == "onprem":
+                heading = "Modules"
+            elif len(providers) > 1:
+                heading = f"{provider.upper()} {heading}"
+            lines.append(f"    with Cluster({heading!r}):")
+            indent = "        "
+        for address in addresses:
+            cls = nodes[address]["node"].rsplit(".", 1)[1]
+            lines.append(f"{indent}{variables[address]} = {cls}({nodes[address]['label']!r})")
+
+    if edges:
+        lines.append("")
+        for source, target in edges:
+            lines.append(f"    {variables[source]} >> {variables[target]}")
+    return "\n".join(lines) + "\n"
+
+
+def parse_node_classes(text):
+    """LLM reply with a {resource type: node class} dict -> the entries that look like node classes"""
+    match = re.search(r"\{.*\}", text or "", re.DOTALL)
+    if not match:
+        raise TerraformError("Reply has no node class mapping")
+    try:
+        mapping = ast.literal_eval(match.group(0))
+    except (ValueError, SyntaxError) as e:
+        raise TerraformError(f"Unreadable node class mapping: {e}")
+    node_class = re.compile(r"^(?:diagrams\.)?([a-z0-9]+\.[a-z0-9_]+\.[A-Z]\w*)$")
+    return {
+        str(kind): node_class.match(str(path)).group(1)
+        for kind, path in (mapping.items() if isinstance(mapping, dict) else [])
+        if node_class.match(str(path))
+    }
@@ -0,0 +1,52 @@
+import pytest
+
+from code_slice import CodeSlice
+from edit_patch import apply_patch, extract_diff, PatchError
+
+SOURCE = "a\nb\nc\nd\ne\n"
+
+
+def test_replaces_matched_lines():
+    diff = "@@ -2,2 +2,2 @@\n b\n-c\n+C\n"
+    assert apply_patch(SOURCE, diff) == "a\nb\nC\nd\ne\n"
+
+
+def test_insertion_follows_old_start_line():
+    assert apply_patch(SOURCE, "@@ -5,0 +6,1 @@\n+Y\n") == "a\nb\nc\nd\ne\nY\n"
+    assert apply_patch(SOURCE, "@@ -2,0 +3,1 @@\n+Y\n") == "a\nb\nY\nc\nd\ne\n"
+
+
+def test_insertion_at_top_of_file():
+    assert apply_patch(SOURCE, "@@ -0,0 +1,1 @@\n+Y\n") == "Y\na\nb\nc\nd\ne\n"
+
+
+def test_insertion_through_a_slice_uses_source_line_numbers():
+    source = "".join(f"l{i}\n" for i in range(10))
+    excerpt = CodeSlice(source, {5, 6, 7}, "#")
+    # Excerpt: 1 marker (l0-l4), 2 l5, 3 l6, 4 l7, 5 marker (l8-l9)
+    after_l6 = apply_patch(source, "@@ -3,0 +4,1 @@\n+Y\n", excerpt.source_line)
+    assert after_l6.splitlines()[6:9] == ["l6", "Y", "l7"]
+    after_marker = apply_patch(source, "@@ -1,0 +2,1 @@\n+Y\n", excerpt.source_line)
+    assert after_marker.splitlines()[4:7] == ["l4", "Y", "l5"]
+    at_end = apply_patch(source, "@@ -5,0 +6,1 @@\n+Y\n", excerpt.source_line)
+    assert at_end.splitlines()[-2:] == ["l9", "Y"]
+
+
+def test_insertion_without_header_line_numbers_appends():
+    assert apply_patch(SOURCE, "@@ @@\n+Y\n") == "a\nb\nc\nd\ne\nY\n"
+
+
+def test_hunks_are_found_by_content_not_line_numbers():
+    diff = "@@ -40,1 +40,1 @@\n-d\n+D\n"
+    assert apply_patch(SOURCE, diff) == "a\nb\nc\nD\ne\n"
+
+
+def test_mismatched_hunk_raises():
+    with pytest.raises(PatchError):
+        apply_patch(SOURCE, "@@ -1,1 +1,1 @@\n-z\n+Z\n")
+
+
+def test_extract_diff_from_fenced_reply():
+    reply = "Here you go:\n```diff\n@@ -1 +1 @@\n-a\n+A\n```\nTERMINATE"
+    assert extract_diff(reply) == "@@ -1 +1 @@\n-a\n+A\n"
+    assert extract_diff("no changes here") is None
@@ -0,0 +1,83 @@
+from graph_ir import parse_cloud, parse_mermaid, parse_d2
+
+CLOUD = '''from diagrams import Diagram, Cluster, Edge
+from diagrams.aws.compute import EC2
+from diagrams.aws.storage import S3
+
+with Diagram("Web", show=False):
+    with Cluster("App"):
+        web = EC2("web")
+        workers = [EC2("w1"), EC2("w2")]
+    bucket = S3("assets")
+    web >> Edge(label="upload") >> bucket
+    bucket << web
+'''
+
+
+# ============================================================================
+#                           PARSERS
+# ============================================================================
+
+def test_parse_cloud_nodes_groups_and_edges():
+    graph = parse_cloud(CLOUD)
+    assert graph.nodes["web"]["kind"] == "EC2"
+    assert graph.nodes["bucket"]["label"] == "assets"
+    [cluster] = graph.groups
+    assert graph.groups[cluster]["label"] == "App"
+    assert graph.nodes["web"]["group"] == cluster
+    assert [(e["source"], e["target"], e["label"]) for e in graph.edges] == [
+        ("web", "bucket", "upload"), ("web", "bucket", ""),
+    ]
+
+
+def test_parse_mermaid_labels_subgraphs_and_edges():
+    graph = parse_mermaid("graph TD\nsubgraph cloud [Cloud]\nA[Start] -->|go| B((Mid))\nend\nB --> C\n")
+    assert graph.nodes["A"]["label"] == "Start"
+    assert graph.nodes["B"]["attrs"]["shape"] == "circle"
+    assert graph.nodes["A"]["group"] == "cloud"
+    assert graph.nodes["C"]["group"] is None
+    assert [(e["source"], e["target"], e["label"]) for e in graph.edges] == [("A", "B", "go"), ("B", "C", "")]
+
+
+def test_parse_d2_containers_and_edges():
+    graph = parse_d2("aws: AWS {\n  lb: Load Balancer\n  lb -> web: HTTP\n}\nuser <- aws.lb\n")
+    assert graph.groups["aws"]["label"] == "AWS"
+    assert graph.nodes["aws.lb"]["group"] == "aws"
+    assert graph.nodes["aws.web"]["label"] == "web"
+    assert [(e["source"], e["target"], e["label"]) for e in graph.edges] == [
+        ("aws.lb", "aws.web", "HTTP"), ("aws.lb", "user", ""),
+    ]
+
+
+def test_parse_d2_drops_inline_block_from_labels():
+    graph = parse_d2("db: Database {shape: cylinder}\ncache: {shape: cylinder}\ndb -> cache: reads {style.stroke: red}\n")
+    assert graph.nodes["db"]["label"] == "Database"
+    assert graph.nodes["cache"]["label"] == "cache"
+    assert graph.edges[0]["label"] == "reads"
+
+
+# ============================================================================
+#                           LOOKUPS
+# ============================================================================
+
+def test_find_by_label_and_kind():
+    graph = parse_cloud(CLOUD)
+    assert graph.find("the assets") == ["bucket"]
+    assert graph.find("S3 bucket") == ["bucket"]
+    assert sorted(graph.find("EC2 instances")) == ["web"]
+
+
+def test_find_nested_d2_shape_by_last_segment():
+    graph = parse_d2("aws: {\n  lb: Load Balancer\n}\ngcp: {\n  lb\n}\nuser -> aws.lb\n")
+    assert graph.find("load balancer") == ["aws.lb"]
+    # Both containers have an lb: every match is returned and the caller decides
+    assert sorted(graph.find("lb")) == ["aws.lb", "gcp.lb"]
+
+
+def test_find_unknown_phrase():
+    assert parse_mermaid("graph TD\nA --> B\n").find("queue") == []
+
+
+def test_mentioned_in_free_text():
+    graph = parse_d2("aws: {\n  lb: Load Balancer\n  web\n}\nuser -> aws.lb\n")
+    assert sorted(graph.mentioned_in("put a cache between the load balancer and web")) == ["aws.lb", "aws.web"]
@@ -0,0 +1,127 @@
+import pytest
+
+from local_edits import apply_local_edit, parse_edit_request, LocalEditError
+
+CLOUD = '''from diagrams import Diagram, Cluster
+from diagrams.aws.compute import EC2
+from diagrams.aws.network import ELB
+from diagrams.aws.storage import S3
+
+with Diagram("Web", filename="output/web", show=False):
+    lb = ELB("lb")
+    with Cluster("App"):
+        web = EC2("web")
+    bucket = S3("assets")
+    lb >> web >> bucket
+'''
+
+D2 = '''user -> aws.lb: HTTPS
+aws: AWS {
+  lb: Load Balancer
+  lb -> web -> db
+}
+'''
+
+
+# ============================================================================
+#                           REQUEST PARSING
+# ============================================================================
+
+def test_parse_remove_with_several_targets():
+    assert parse_edit_request("Please delete web, db & cache from the diagram.") == ("remove", ["web", "db", "cache"])
+    assert parse_edit_request("remove the S3 bucket and the lb") == ("remove", ["the s3 bucket", "the lb"])
+
+
+def test_parse_rename_keeps_the_new_label_as_written():
+    assert parse_edit_request('rename web as "Front End"') == ("rename", "web", "Front End")
+
+
+def test_parse_rejects_compound_requests():
+    assert parse_edit_request("remove web and then add a queue") is None
+    assert parse_edit_request("remove the arrow between web and db") is None
+    assert parse_edit_request("add a queue") is None
+
+
+# ============================================================================
+#                           PYTHON DIAGRAMS
+# ============================================================================
+
+def test_cloud_remove_keeps_the_rest_of_the_chain():
+    code, done = apply_local_edit("cloud", CLOUD, "remove the S3 bucket")
+    assert done == ["Removed assets"]
+    assert "lb >> web\n" in code
+    assert "S3" not in code
+
+
+def test_cloud_remove_cluster_takes_its_nodes():
+    code, _ = apply_local_edit("cloud", CLOUD, "remove App")
+    assert "Cluster(" not in code and "EC2" not in code
+    assert 'lb = ELB("lb")' in code and 'bucket = S3("assets")' in code
+
+
+def test_cloud_rename_rewrites_the_label():
+    code, done = apply_local_edit("cloud", CLOUD, "rename web to Frontend")
+    assert 'web = EC2("Frontend")' in code
+    assert done == ["Renamed web to Frontend"]
+
+
+# ============================================================================
+#                           MERMAID
+# ============================================================================
+
+def test_mermaid_remove_middle_node_keeps_both_ends():
+    code, _ = apply_local_edit("mermaid", "graph TD\nA --> B\nB --> C\n", "remove B")
+    assert code == "graph TD\nA\nC\n"
+
+
+def test_mermaid_remove_keeps_label_declarations_of_neighbours():
+    code, _ = apply_local_edit("mermaid", "graph TD\nA[Start] --> B[Mid] --> C[End]\n", "remove Mid")
+    assert code == "graph TD\nA[Start]\nC[End]\n"
+
+
+def test_mermaid_survivor_declared_elsewhere_is_not_repeated():
+    code, _ = apply_local_edit("mermaid", "graph TD\nA --> B\nA --> C\n", "remove B")
+    assert code == "graph TD\nA --> C\n"
+
+
+def test_mermaid_rename_ambiguous_target_falls_back():
+    with pytest.raises(LocalEditError):
+        apply_local_edit("mermaid", "graph TD\nA[Server] --> B[Server]\n", "rename server to API")
+
+
+# ============================================================================
+#                           D2
+# ============================================================================
+
+def test_d2_remove_keeps_the_other_end_of_a_broken_connection():
+    code, done = apply_local_edit("d2", "user -> lb: HTTPS\nlb: Load Balancer\nlb -> web -> db\n",
+                                  "remove the load balancer")
+    assert code == "user\nweb -> db\n"
+    assert done == ["Removed Load Balancer"]
+
+
+def test_d2_remove_nested_shape():
+    code, _ = apply_local_edit("d2", D2, "remove the load balancer")
+    assert code == "user\naws: AWS {\n  web -> db\n}\n"
+
+
+def test_d2_remove_container():
+    code, done = apply_local_edit("d2", D2, "remove aws")
+    assert code == "user\n"
+    assert done == ["Removed AWS"]
+
+
+def test_d2_rename_nested_shape():
+    code, _ = apply_local_edit("d2", "aws: {\n  web: Web\n}\n", "rename web to Frontend")
+    assert code == 'aws: {\n  web: "Frontend"\n}\n'
+
+
+def test_d2_remove_that_would_lose_a_container_falls_back():
+    # aws only exists through aws.lb, so removing lb would drop it too
+    with pytest.raises(LocalEditError):
+        apply_local_edit("d2", "user -> aws.lb\n", "remove lb")
+
+
+def test_unknown_target_falls_back():
+    with pytest.raises(LocalEditError):
+        apply_local_edit("d2", D2, "remove the queue")
@@ -0,0 +1,244 @@
+import sys
+import base64
+import asyncio
+import textwrap
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import mermaid_render
+from mermaid_render import (
+    HttpMermaidRenderer, LocalMermaidRenderer, MermaidRenderer, MermaidRenderError, blocking_caller
+)
+
+CODE = "graph TD; A-->B"
+
+
+# ============================================================================
+#                           HTTP BACKEND
+# ============================================================================
+
+class StubMermaidServer:
+    """mermaid.ink stand-in: answers with queued statuses, then 200s, and logs every request"""
+
+    def __init__(self):
+        self.statuses = []
+        self.requests = []  # (path, client port)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse is visible
+
+            def do_GET(self):
+                stub.requests.append((self.path, self.client_address[1]))
+                status = stub.statuses.pop(0) if stub.statuses else 200
+                body = b"PNG:" + self.path.encode() if status == 200 else b"busy"
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    server = StubMermaidServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def http_renderer(stub_server):
+    renderer = HttpMermaidRenderer(endpoint=stub_server.endpoint, timeout=5, retries=2, backoff=0.01)
+    yield renderer
+    renderer.close()
+
+
+def test_base_renderer_is_abstract():
+    with pytest.raises(TypeError):
+        MermaidRenderer()
+
+
+def test_http_render_encodes_code_in_url(http_renderer, stub_server):
+    data = http_renderer.render(CODE, "png")
+    path = stub_server.requests[0][0]
+    assert path.startswith("/img/") and path.endswith("?type=png")
+    encoded = path[len("/img/"):-len("?type=png")]
+    assert base64.urlsafe_b64decode(encoded).decode() == CODE
+    assert data == b"PNG:" + path.encode()
+
+
+def test_http_svg_uses_svg_route(http_renderer, stub_server):
+    http_renderer.render(CODE, "svg")
+    assert stub_server.requests[0][0].startswith("/svg/")
+
+
+def test_http_session_reuses_connection(http_renderer, stub_server):
+    http_renderer.render(CODE)
+    http_renderer.render(CODE + ";")
+    ports = {port for _, port in stub_server.requests}
+    assert len(stub_server.requests) == 2 and len(ports) == 1
+
+
+def test_http_retries_transient_errors(http_renderer, stub_server):
+    stub_server.statuses = [503, 429]
+    assert http_renderer.render(CODE).startswith(b"PNG:")
+    assert len(stub_server.requests) == 3
+
+
+def test_http_retries_back_off(http_renderer, stub_server):
+    retry = http_renderer.session.get_adapter(stub_server.endpoint).max_retries
+    assert retry.total == 2 and retry.backoff_factor == 0.01
+
+
+def test_http_gives_up_after_retries(http_renderer, stub_server):
+    stub_server.statuses = [503] * 10
+    with pytest.raises(MermaidRenderError, match="503"):
+        http_renderer.render(CODE)
+    assert len(stub_server.requests) == 3
+
+
+def test_http_client_errors_are_not_retried(http_renderer, stub_server):
+    stub_server.statuses = [400]
+    with pytest.raises(MermaidRenderError, match="400"):
+        http_renderer.render(CODE)
+    assert len(stub_server.requests) == 1
+
+
+def test_http_async_retries_with_exponential_backoff(http_renderer, stub_server, monkeypatch):
+    delays = []
+    sleep = asyncio.sleep
+
+    async def record_sleep(delay):
+        delays.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(mermaid_render.asyncio, "sleep", record_sleep)
+    stub_server.statuses = [502, 503]
+    data = asyncio.run(http_renderer.a_render(CODE))
+    assert data.startswith(b"PNG:")
+    assert delays == [0.01, 0.02]
+    assert len(stub_server.requests) == 3
+
+
+def test_http_async_gives_up_after_retries(http_renderer, stub_server):
+    stub_server.statuses = [500] * 10
+    with pytest.raises(MermaidRenderError, match="500"):
+        asyncio.run(http_renderer.a_render(CODE))
+    assert len(stub_server.requests) == 3
+
+
+def test_http_async_pools_within_a_loop(http_renderer, stub_server):
+    async def render_twice():
+        await http_renderer.a_render(CODE)
+        await http_renderer.a_render(CODE + ";")
+
+    asyncio.run(render_twice())
+    assert len({port for _, port in stub_server.requests}) == 1
+
+
+def test_http_async_client_closes_with_its_loop(http_renderer):
+    async def render():
+        await http_renderer.a_render(CODE)
+        return next(iter(http_renderer.async_clients.values()))[0]
+
+    client = asyncio.run(render())
+    assert client.is_closed
+
+
+def test_http_blocking_callers_share_the_session(http_renderer, stub_server):
+    token = blocking_caller.set(True)
+    try:
+        asyncio.run(http_renderer.a_render(CODE))
+        asyncio.run(http_renderer.a_render(CODE + ";"))
+    finally:
+        blocking_caller.reset(token)
+    assert len(http_renderer.async_clients) == 0
+    assert len({port for _, port in stub_server.requests}) == 1
+
+
+# ============================================================================
+#                           LOCAL BACKEND
+# ============================================================================
+
+# Speaks the mermaid_server.mjs protocol; the diagram code picks the behaviour
+STUB_RENDERER = textwrap.dedent('''
+    import os, sys, json, time, base64
+    for line in sys.stdin:
+        request = json.loads(line)
+        code = request["code"]
+        if code == "crash":
+            sys.exit(1)
+        if code == "hang":
+            time.sleep(60)
+        if code == "bad":
+            reply = {"ok": False, "error": "Parse error on line 1"}
+        else:
+            data = f"{os.getpid()}:{request['format']}:{code}".encode()
+            reply = {"ok": True, "data": base64.b64encode(data).decode()}
+        print(json.dumps(reply), flush=True)
+''')
+
+
+@pytest.fixture
+def local_renderer(tmp_path):
+    script = tmp_path / "stub_renderer.py"
+    script.write_text(STUB_RENDERER)
+    renderer = LocalMermaidRenderer(command=f'"{sys.executable}" "{script}"', timeout=2)
+    yield renderer
+    renderer.close()
+
+
+def rendered_pid(data):
+    return data.decode().split(":", 1)[0]
+
+
+def test_local_render_round_trip(local_renderer):
+    assert local_renderer.render(CODE, "svg").decode().endswith(f":svg:{CODE}")
+
+
+def test_local_process_is_reused(local_renderer):
+    first = local_renderer.render(CODE)
+    second = local_renderer.render(CODE + ";")
+    assert rendered_pid(first) == rendered_pid(second)
+
+
+def test_local_error_reply_keeps_process(local_renderer):
+    pid = rendered_pid(local_renderer.render(CODE))
+    with pytest.raises(MermaidRenderError, match="Parse error"):
+        local_renderer.render("bad")
+    assert rendered_pid(local_renderer.render(CODE)) == pid
+
+
+def test_local_crash_restarts_process(local_renderer):
+    pid = rendered_pid(local_renderer.render(CODE))
+    with pytest.raises(MermaidRenderError, match="exited"):
+        local_renderer.render("crash")
+    assert local_renderer.process is None
+    assert rendered_pid(local_renderer.render(CODE)) != pid
+
+
+def test_local_timeout_kills_process(local_renderer):
+    local_renderer.timeout = 0.5
+    with pytest.raises(MermaidRenderError, match="timed out"):
+        local_renderer.render("hang")
+    assert local_renderer.render(CODE).decode().endswith(CODE)
+
+
+def test_local_async_render(local_renderer):
+    assert asyncio.run(local_renderer.a_render(CODE)).decode().endswith(f":png:{CODE}")
@@ -0,0 +1,162 @@
+import os
+import io
+import sys
+import queue
+import atexit
+import runpy
+import pkgutil
+import importlib
+import threading
+import traceback
+import contextlib
+import multiprocessing
+
+# ============================================================================
+#                           WARM DIAGRAM WORKERS
+# ============================================================================
+# Kept separate from main.py on purpose: spawned workers import this module,
+# and it must stay free of the agent/LLM setup that main.py does on import.
+# (When the app is started as `python main.py`, spawn still re-imports main.py
+# in each worker as __mp_main__; that only costs import time, since agents are
+# built lazily and nothing under its __main__ guard runs.)
+
+PRELOAD_PROVIDERS = ["aws", "azure", "gcp", "onprem", "k8s", "generic", "programming", "saas"]
+
+
+def _preload_diagrams():
+    """Import diagrams and its provider modules once, before any job arrives"""
+    import diagrams  # noqa: F401
+    for provider in PRELOAD_PROVIDERS:
+        try:
+            package = importlib.import_module(f"diagrams.{provider}")
+        except ImportError:
+            continue
+        for module in pkgutil.iter_modules(package.__path__):
+            try:
+                importlib.import_module(f"diagrams.{provider}.{module.name}")
+            except Exception:
+                pass
+
+
+def _run_script(script_path, cwd):
+    """Run one generated script as __main__ and capture what it prints"""
+    output = io.StringIO()
+    old_argv, old_path = sys.argv, list(sys.path)
+    try:
+        os.chdir(cwd)
+        sys.argv = [script_path]
+        sys.path.insert(0, os.path.dirname(script_path))
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            runpy.run_path(script_path, run_name="__main__")
+        return True, output.getvalue()
+    except BaseException:
+        return False, output.getvalue() + traceback.format_exc()
+    finally:
+        sys.argv, sys.path[:] = old_argv, old_path
+
+
+def _worker_main(conn):
+    _preload_diagrams()
+    conn.send("ready")
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        conn.send(_run_script(*job))
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.ready = False
+
+    def wait_ready(self, timeout):
+        """Wait for the worker to finish preloading; False if it has not within timeout"""
+        if not self.ready and self.conn.poll(timeout):
+            self.ready = self.conn.recv() == "ready"
+        return self.ready
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class DiagramWorkerPool:
+    """Pool of pre-warmed interpreters that run diagrams scripts"""
+
+    def __init__(self, size=2, max_jobs=50, start_timeout=120):
+        self.ctx = multiprocessing.get_context("spawn")
+        self.max_jobs = max_jobs
+        self.start_timeout = start_timeout
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(_Worker(self.ctx))
+
+    def run(self, script_path, cwd, timeout=60):
+        """Run a script in a warm worker. Returns (ok, output_or_traceback).
+
+        The timeout covers the script only: a freshly spawned worker is first
+        given start_timeout to finish preloading.
+        """
+        worker = self.idle.get()
+        try:
+            if not worker.wait_ready(self.start_timeout):
+                worker.kill()
+                worker = None
+                return False, f"Worker did not start within {self.start_timeout}s"
+            worker.conn.send((os.path.abspath(script_path), cwd))
+            if not worker.conn.poll(timeout):
+                worker.kill()
+                worker = None
+                return False, f"Timed out after {timeout}s"
+            ok, output = worker.conn.recv()
+            worker.jobs += 1
+            # Recycle after N jobs, or after a failure that may have left state behind
+            if worker.jobs >= self.max_jobs or not ok:
+                worker.stop()
+                worker = None
+            return ok, output
+        except (EOFError, OSError) as e:
+            worker.kill()
+            worker = None
+            return False, f"Worker crashed: {e}"
+        finally:
+            self.idle.put(worker if worker is not None else _Worker(self.ctx))
+
+    def shutdown(self):
+        while True:
+            try:
+                self.idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool(size, max_jobs):
+    """Create the shared pool on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = DiagramWorkerPool(size=size, max_jobs=max_jobs)
+            atexit.register(_pool.shutdown)
+        return _pool